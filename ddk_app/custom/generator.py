@@ -1,14 +1,31 @@
 from constructs import Construct
 import builtins
-from aws_cdk import aws_ecs, aws_iam
+import typing
+from aws_cdk import aws_ecs, aws_iam, SymlinkFollowMode
 
 
 class Generator(Construct):
 
-    def __init__(self, scope: "Construct", id: builtins.str, tps: int) -> None:
+    def __init__(
+        self,
+        scope: "Construct",
+        id: builtins.str,
+        tps: int,
+        desired_count: int = 1,
+        cpu: int = 256,
+        memory_limit_mib: int = 512,
+        environment: typing.Optional[typing.Mapping[str, str]] = None
+    ) -> None:
 
         super().__init__(scope, id)
 
+        # a taxa e controlada pelo agendador de cada task, nao pelo numero de tasks
+        container_environment = {
+            'PRODUCER_MODE': 'batch',
+            'TARGET_TPS': str(tps / desired_count),
+            **(environment or {})
+        }
+
         taskrole = aws_iam.Role(
             self,
             'taskrole',
@@ -42,11 +59,19 @@ class Generator(Construct):
 
         cluster = aws_ecs.Cluster(self, 'Cluster')
 
-        taskdef = aws_ecs.FargateTaskDefinition(self, 'task-generator', task_role=taskrole)
+        taskdef = aws_ecs.FargateTaskDefinition(
+            self,
+            'task-generator',
+            task_role=taskrole,
+            cpu=cpu,
+            memory_limit_mib=memory_limit_mib
+        )
 
         taskdef.add_container(
             'Generator',
-            image = aws_ecs.ContainerImage.from_asset('generator_app/'),
+            # wire.py e um link para lambda_app/shared, resolvido ao empacotar a imagem
+            image = aws_ecs.ContainerImage.from_asset('generator_app/', follow_symlinks=SymlinkFollowMode.ALWAYS),
+            environment=container_environment,
             logging=aws_ecs.AwsLogDriver(stream_prefix="Generator", mode=aws_ecs.AwsLogDriverMode.NON_BLOCKING)
         )
         aws_ecs.FargateService(
@@ -55,5 +80,5 @@ class Generator(Construct):
             cluster=cluster,
             assign_public_ip=True,
             task_definition=taskdef,
-            desired_count=tps,
+            desired_count=desired_count,
         )
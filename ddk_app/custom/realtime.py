@@ -5,6 +5,7 @@ from aws_cdk import (
     aws_kinesis,
     aws_lambda as lambda__,
     aws_dynamodb as ddb,
+    aws_sqs as sqs,
     aws_apigateway,
     aws_s3_assets,
     aws_iam as iam,
@@ -17,9 +18,12 @@ from aws_cdk.aws_kinesisanalyticsv2 import(
     CfnApplication as KDAApp
 )
 
+from aws_cdk.aws_s3 import BucketEncryption
+
 from aws_ddk_core.resources import (
     LambdaFactory,
     KinesisStreamsFactory as dstream,
+    S3Factory as s3,
 )
 
 class RealTimeAnalytics(Construct):
@@ -100,6 +104,20 @@ class RealTimeAnalytics(Construct):
                             f"arn:aws:kinesis:{self.region}:{self.account}:stream/card-stream"
                         ]
                     ),
+                    iam.PolicyStatement(
+                        actions=[
+                            "kinesis:DescribeStreamSummary",
+                            "kinesis:RegisterStreamConsumer",
+                            "kinesis:DeregisterStreamConsumer",
+                            "kinesis:DescribeStreamConsumer",
+                            "kinesis:ListStreamConsumers",
+                            "kinesis:SubscribeToShard"
+                        ],
+                        resources=[
+                            f"arn:aws:kinesis:{self.region}:{self.account}:stream/card-stream",
+                            f"arn:aws:kinesis:{self.region}:{self.account}:stream/card-stream/consumer/*"
+                        ]
+                    ),
                     iam.PolicyStatement(
                         actions=[
                             "kinesis:DescribeStream",
@@ -177,6 +195,8 @@ class RealTimeAnalytics(Construct):
                                 "input.stream.name": "card-stream",
                                 "flink.stream.initpos": "LATEST",
                                 "aws.region": "us-east-1",
+                                "scan.stream.recordpublisher": "POLLING",
+                                "scan.shard.discovery.intervalmillis": "10000",
                             }
                         ),
                         KDAApp.PropertyGroupProperty(
@@ -186,7 +206,30 @@ class RealTimeAnalytics(Construct):
                                 "shard.count": "1",
                                 "aws.region": "us-east-1",
                             }
-                        )
+                        ),
+                        KDAApp.PropertyGroupProperty(
+                            property_group_id="aggregation.config.0",
+                            property_map={
+                                "mode": "window",
+                                "window.type": "tumbling",
+                                "window.size.seconds": "10",
+                                "window.slide.seconds": "5",
+                                "valor.threshold": "5000",
+                                "quantidade.threshold": "0",
+                            }
+                        ),
+                        KDAApp.PropertyGroupProperty(
+                            property_group_id="velocity.config.0",
+                            property_map={
+                                "max.transacoes.minuto": "5",
+                                "max.gasto.hora": "10000",
+                                "max.estados.hora": "3",
+                                "valor.alto": "5000",
+                                "score.threshold": "50",
+                                "state.ttl.minutes": "120",
+                            }
+                        ),
+                        # sem tuning.config.0: padroes do Flink ate o A/B do README ser registrado
                     ]
                 ),
                 flink_application_configuration=KDAApp.FlinkApplicationConfigurationProperty(
@@ -221,11 +264,46 @@ class RealTimeAnalytics(Construct):
             sort_key=ddb.Attribute(name='transaction_id', type=ddb.AttributeType.STRING)
         )
 
+        ### Indice por horario para consultas de janela de tempo por cartao
+        ddb_realtime_table.add_global_secondary_index(
+            index_name='horario-index',
+            partition_key=ddb.Attribute(name='numero_cartao', type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name='horario_transacao', type=ddb.AttributeType.STRING),
+            projection_type=ddb.ProjectionType.ALL
+        )
+
+        ### Tabela de resumo por cartao mantida pelo consumidor
+        ddb_summary_table = ddb.Table(
+            self,
+            id='realtime-summary-table',
+            encryption=ddb.TableEncryption.CUSTOMER_MANAGED,
+            encryption_key=kms_cmk_key,
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST,
+            point_in_time_recovery=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            partition_key=ddb.Attribute(name='numero_cartao', type=ddb.AttributeType.STRING)
+        )
+
+        ### Layer com o modulo de formato de registros (wire) compartilhado com o gerador
+        wire_layer = lambda__.LayerVersion(
+            self,
+            'wire-layer',
+            code=lambda__.Code.from_asset('lambda_app/shared'),
+            compatible_runtimes=[lambda__.Runtime.PYTHON_3_9],
+            description='Formato JSON/binario dos registros bbbank'
+        )
+
         ### Funcao lambda consumidora Data Stream Sink
         props = {
             "environment": {
-                'TABLE': ddb_realtime_table.table_name
-            }
+                'TABLE': ddb_realtime_table.table_name,
+                'SUMMARY_TABLE': ddb_summary_table.table_name,
+                # necessario para o resumo por cartao nao somar reentregas: grava com
+                # PutItem condicional, um item por chamada em paralelo (MAX_WORKERS),
+                # em vez de BatchWriteItem
+                'CONDITIONAL_WRITE': 'true'
+            },
+            "layers": [wire_layer]
         }
         lmb_consumer = LambdaFactory.function(
             self,
@@ -238,9 +316,22 @@ class RealTimeAnalytics(Construct):
             **props
         )
 
+        ### Fila de registros que falharam apos as tentativas do consumidor
+        dlq_consumer = sqs.Queue(
+            self,
+            'realtime-consumer-dlq',
+            encryption=sqs.QueueEncryption.KMS,
+            encryption_master_key=kms_cmk_key,
+            retention_period=Duration.days(14)
+        )
+
         lmb_consumer_event_source = event_source.KinesisEventSource(
             stream_realtime,
-            starting_position=lambda__.StartingPosition.TRIM_HORIZON
+            starting_position=lambda__.StartingPosition.TRIM_HORIZON,
+            report_batch_item_failures=True,
+            bisect_batch_on_error=True,
+            retry_attempts=3,
+            on_failure=event_source.SqsDlq(dlq_consumer)
         )
 
         lmb_consumer.add_event_source(lmb_consumer_event_source)
@@ -249,6 +340,17 @@ class RealTimeAnalytics(Construct):
 
 
         ddb_realtime_table.grant_write_data(lmb_consumer)
+        ddb_summary_table.grant_read_write_data(lmb_consumer)
+
+        ### Bucket das exportacoes da tabela realtime
+        s3_export = s3.bucket(
+            self,
+            "realtime-export",
+            environment_id,
+            encryption_key=kms_cmk_key,
+            encryption=BucketEncryption.KMS,
+            removal_policy=RemovalPolicy.DESTROY
+        )
 
         ### Funcao lambda backend api gateway
         lmb_api = LambdaFactory.function(
@@ -258,14 +360,27 @@ class RealTimeAnalytics(Construct):
             code=lambda__.Code.from_asset('lambda_app/api'),
             handler='function.handler',
             runtime=lambda__.Runtime.PYTHON_3_9,
-            function_name='api-backend'
+            function_name='api-backend',
+            timeout=Duration.seconds(29),
+            memory_size=512,
+            environment={
+                'TABLE': ddb_realtime_table.table_name,
+                'SUMMARY_TABLE': ddb_summary_table.table_name,
+                'TIME_INDEX': 'horario-index',
+                'CACHE_TTL': '5',
+                'EXPORT_BUCKET': s3_export.bucket_name
+            }
         )
 
         ddb_realtime_table.grant_read_data(lmb_api)
+        ddb_summary_table.grant_read_data(lmb_api)
+        s3_export.grant_read_write(lmb_api)
 
         api_gateway = aws_apigateway.LambdaRestApi(
             self,
             id='bbbank-api',
-            handler=lmb_api, 
+            handler=lmb_api,
+            # respostas comprimidas pelo lambda voltam em base64 e sao repassadas como binario
+            binary_media_types=['*/*'],
         )
 
@@ -5,16 +5,18 @@ tumbling-windows.py
 ~~~~~~~~~~~~~~~~~~~
 This module:
     1. Creates a table environment
-    2. Creates a source table from a Kinesis Data Stream
-    3. Creates a sink table writing to a Kinesis Data Stream
-    4. Queries from the Source Table and
-       creates a tumbling window over 10 seconds to calculate the cumulative PRICE over the window.
-    5. These tumbling window results are inserted into the Sink table.
+    2. Creates a source table from a Kinesis Data Stream (or datagen/filesystem locally)
+    3. Creates a sink table writing to a Kinesis Data Stream (or print/filesystem/blackhole locally)
+    4. Queries from the Source Table and creates a tumbling or hopping window
+       per card to calculate the count, sum and max of valor over the window.
+    5. The windows above the thresholds are inserted into the Sink table.
+With mode velocity (or both) the transactions are also scored one by one
+by the keyed-state operator in velocity.py.
 """
 
+from pyflink.datastream import StreamExecutionEnvironment
 from pyflink.table import EnvironmentSettings, StreamTableEnvironment
-from pyflink.table.window import Tumble
-from pyflink.table.expressions import col
+from velocity import perform_velocity_scoring
 import os
 import json
 
@@ -22,19 +24,23 @@ import json
 env_settings = (
     EnvironmentSettings.new_instance().in_streaming_mode().use_blink_planner().build()
 )
-table_env = StreamTableEnvironment.create(environment_settings=env_settings)
+env = StreamExecutionEnvironment.get_execution_environment()
+table_env = StreamTableEnvironment.create(env, environment_settings=env_settings)
 
 APPLICATION_PROPERTIES_FILE_PATH = "/etc/flink/application_properties.json"  # on kda
+# fora do KDA (MiniCluster local) o arquivo de propriedades vem desta variavel
+LOCAL_PROPERTIES_ENV = "APPLICATION_PROPERTIES_FILE"
 
 
 def get_application_properties():
-    if os.path.isfile(APPLICATION_PROPERTIES_FILE_PATH):
-        with open(APPLICATION_PROPERTIES_FILE_PATH, "r") as file:
+    path = os.environ.get(LOCAL_PROPERTIES_ENV, APPLICATION_PROPERTIES_FILE_PATH)
+    if os.path.isfile(path):
+        with open(path, "r") as file:
             contents = file.read()
             properties = json.loads(contents)
             return properties
     else:
-        print('A file at "{}" was not found'.format(APPLICATION_PROPERTIES_FILE_PATH))
+        print('A file at "{}" was not found'.format(path))
 
 
 def property_map(props, property_group_id):
@@ -43,57 +49,183 @@ def property_map(props, property_group_id):
             return prop["PropertyMap"]
 
 
-def create_table(table_name, stream_name, region, stream_initpos):
-    return """ CREATE TABLE {0} (
+TRANSACTION_COLUMNS = """
                 numero_cartao VARCHAR(30),
                 transaction_id VARCHAR(30),
                 valor DOUBLE,
                 horario_transacao TIMESTAMP(3),
-                WATERMARK FOR horario_transacao AS horario_transacao - INTERVAL '10' SECOND
+                localizacao ROW<lat VARCHAR, lng VARCHAR, cidade VARCHAR, estado VARCHAR>,
+                estado AS localizacao.estado"""
+
+# datagen nao gera valores de uma lista: cartao e estado saem de faixas de inteiros
+# e horario_transacao e o instante de geracao, o que permite medir latencia
+DATAGEN_COLUMNS = """
+                cartao INT,
+                uf INT,
+                transaction_id VARCHAR(30),
+                valor DOUBLE,
+                numero_cartao AS CAST(cartao AS VARCHAR(30)),
+                estado AS CAST(uf AS VARCHAR(2)),
+                horario_transacao AS LOCALTIMESTAMP"""
+
+# resumo indica se as transacoes da linha entram no resumo por cartao do
+# consumidor: linhas de velocidade sim; janelas apenas tumbling e com
+# mode=window, ja que janelas deslizantes se sobrepoem e com mode=both as
+# mesmas transacoes tambem chegam como linhas de velocidade
+ALERT_COLUMNS = """
+                numero_cartao VARCHAR(30),
+                transaction_id VARCHAR(64),
+                valor DOUBLE,
+                horario_transacao TIMESTAMP(3),
+                quantidade BIGINT,
+                maior_valor DOUBLE,
+                score INT,
+                tipo VARCHAR(10),
+                resumo BOOLEAN"""
+
+
+def table_ddl(table_name, columns, options, partitioned=False):
+    return """ CREATE TABLE {0} ({1}
               )
-              PARTITIONED BY (numero_cartao)
-              WITH (
-                'connector' = 'kinesis',
-                'stream' = '{1}',
-                'aws.region' = '{2}',
-                'scan.stream.initpos' = '{3}',
-                'sink.partitioner-field-delimiter' = ';',
-                'sink.producer.collection-max-count' = '100',
-                'sink.producer.aggregation-enabled' = 'false',
-                'format' = 'json',
-                'json.timestamp-format.standard' = 'ISO-8601'
+              {2}WITH (
+                {3}
               ) """.format(
-        table_name, stream_name, region, stream_initpos
+        table_name,
+        columns,
+        "PARTITIONED BY (numero_cartao)\n              " if partitioned else "",
+        ",\n                ".join("'{0}' = '{1}'".format(key, value) for key, value in options.items())
     )
 
 
-def perform_tumbling_window_aggregation(input_table_name):
-    # use SQL Table in the Table API
-    input_table = table_env.from_path(input_table_name)
+def create_table(table_name, config):
+    """Tabela de origem conforme consumer.config.0: connector kinesis (padrao), datagen ou filesystem."""
+    connector = config.get("connector", "kinesis")
+    watermark = ",\n                WATERMARK FOR horario_transacao AS horario_transacao - INTERVAL '10' SECOND"
+    if connector == "kinesis":
+        options = {
+            "connector": "kinesis",
+            "stream": config["input.stream.name"],
+            "aws.region": config["aws.region"],
+            "scan.stream.initpos": config["flink.stream.initpos"],
+            "format": "json",
+            "json.timestamp-format.standard": "ISO-8601",
+        }
+        # chaves scan.* vao direto para o conector (EFO, descoberta de shards)
+        options.update(
+            (key, value) for key, value in sorted(config.items())
+            if key.startswith("scan.") and key != "scan.stream.initpos"
+        )
+        return table_ddl(table_name, TRANSACTION_COLUMNS + watermark, options, partitioned=True)
+    if connector == "filesystem":
+        # ex.: JSONL gravado pelo gerador com RECORD_FILE
+        options = {
+            "connector": "filesystem",
+            "path": config["path"],
+            "format": "json",
+            "json.timestamp-format.standard": "ISO-8601",
+        }
+        return table_ddl(table_name, TRANSACTION_COLUMNS + watermark, options)
+    if connector == "datagen":
+        options = {
+            "connector": "datagen",
+            "rows-per-second": config.get("rows-per-second", "1000"),
+            "fields.cartao.min": "1",
+            "fields.cartao.max": config.get("cartoes", "1000"),
+            "fields.uf.min": "1",
+            "fields.uf.max": "27",
+            "fields.transaction_id.length": "30",
+            "fields.valor.min": "1",
+            "fields.valor.max": config.get("valor.max", "10000"),
+        }
+        if config.get("number-of-rows"):
+            options["number-of-rows"] = config["number-of-rows"]
+        return table_ddl(table_name, DATAGEN_COLUMNS + watermark, options)
+    raise ValueError("Conector de origem desconhecido: {0}".format(connector))
+
+
+def create_sink_table(table_name, config):
+    """Tabela de destino conforme producer.config.0: connector kinesis (padrao), print, filesystem ou blackhole."""
+    connector = config.get("connector", "kinesis")
+    if connector == "kinesis":
+        options = {
+            "connector": "kinesis",
+            "stream": config["output.stream.name"],
+            "aws.region": config["aws.region"],
+            "sink.partitioner-field-delimiter": ";",
+            "sink.producer.collection-max-count": "100",
+            "sink.producer.aggregation-enabled": "true",
+            "format": "json",
+            "json.timestamp-format.standard": "ISO-8601",
+        }
+        return table_ddl(table_name, ALERT_COLUMNS, options, partitioned=True)
+    if connector == "filesystem":
+        options = {
+            "connector": "filesystem",
+            "path": config["path"],
+            "format": "json",
+            "json.timestamp-format.standard": "ISO-8601",
+        }
+        return table_ddl(table_name, ALERT_COLUMNS, options)
+    if connector in ("print", "blackhole"):
+        return table_ddl(table_name, ALERT_COLUMNS, {"connector": connector})
+    raise ValueError("Conector de destino desconhecido: {0}".format(connector))
+
 
-    tumbling_window_table = (
-        input_table.window(
-            Tumble.over("10.seconds").on("horario_transacao").alias("ten_second_window")
+def window_source(input_table_name, config):
+    # window TVF: permite agregacao local-global e mini-batch na janela
+    size = int(config.get("window.size.seconds", "10"))
+    if config.get("window.type", "tumbling") == "hopping":
+        slide = int(config.get("window.slide.seconds", "5"))
+        return "TABLE(HOP(TABLE {0}, DESCRIPTOR(horario_transacao), INTERVAL '{1}' SECOND, INTERVAL '{2}' SECOND))".format(
+            input_table_name, slide, size
         )
-        .group_by("numero_cartao, transaction_id, ten_second_window")
-        .select("numero_cartao, transaction_id, valor.sum as valor, ten_second_window.end as horario_transacao")
-        .filter(col('valor') > float(5000))
+    return "TABLE(TUMBLE(TABLE {0}, DESCRIPTOR(horario_transacao), INTERVAL '{1}' SECOND))".format(
+        input_table_name, size
     )
 
-    return tumbling_window_table
+
+def perform_window_aggregation(input_table_name, config, resumo):
+    # uma linha por cartao e janela; transaction_id identifica a janela para o consumidor
+    valor_threshold = float(config.get("valor.threshold", "5000"))
+    quantidade_threshold = int(config.get("quantidade.threshold", "0"))
+    having = "SUM(valor) > {0}".format(valor_threshold)
+    if quantidade_threshold > 0:
+        having += " OR COUNT(*) >= {0}".format(quantidade_threshold)
+
+    return table_env.sql_query("""
+        SELECT
+            numero_cartao,
+            CONCAT(numero_cartao, '@', CAST(window_end AS VARCHAR)) AS transaction_id,
+            SUM(valor) AS valor,
+            window_end AS horario_transacao,
+            COUNT(*) AS quantidade,
+            MAX(valor) AS maior_valor,
+            CAST(NULL AS INT) AS score,
+            'janela' AS tipo,
+            {2} AS resumo
+        FROM {0}
+        GROUP BY numero_cartao, window_start, window_end
+        HAVING {1}
+    """.format(window_source(input_table_name, config), having, "TRUE" if resumo else "FALSE"))
+
+
+def configure(config):
+    """Aplica tuning.config.0: paralelismo do job e opcoes table.* (mini-batch, local-global, distinct split)."""
+    configuration = table_env.get_config().get_configuration()
+    for key, value in config.items():
+        if key == "parallelism":
+            env.set_parallelism(int(value))
+        else:
+            configuration.set_string(key, value)
 
 
 def main():
     # Application Property Keys
     input_property_group_key = "consumer.config.0"
     producer_property_group_key = "producer.config.0"
-
-    input_stream_key = "input.stream.name"
-    input_region_key = "aws.region"
-    input_starting_position_key = "flink.stream.initpos"
-
-    output_stream_key = "output.stream.name"
-    output_region_key = "aws.region"
+    aggregation_property_group_key = "aggregation.config.0"
+    velocity_property_group_key = "velocity.config.0"
+    tuning_property_group_key = "tuning.config.0"
 
     # tables
     input_table_name = "input_table"
@@ -104,36 +236,42 @@ def main():
 
     input_property_map = property_map(props, input_property_group_key)
     output_property_map = property_map(props, producer_property_group_key)
+    aggregation_property_map = property_map(props, aggregation_property_group_key) or {}
+    velocity_property_map = property_map(props, velocity_property_group_key) or {}
+    tuning_property_map = property_map(props, tuning_property_group_key) or {}
+    mode = aggregation_property_map.get("mode", "window")
 
-    input_stream = input_property_map[input_stream_key]
-    input_region = input_property_map[input_region_key]
-    stream_initpos = input_property_map[input_starting_position_key]
-
-    output_stream = output_property_map[output_stream_key]
-    output_region = output_property_map[output_region_key]
+    configure(tuning_property_map)
 
     # 2. Creates a source table from a Kinesis Data Stream
-    table_env.execute_sql(
-        create_table(input_table_name, input_stream, input_region, stream_initpos)
-    )
+    table_env.execute_sql(create_table(input_table_name, input_property_map))
 
     # 3. Creates a sink table writing to a Kinesis Data Stream
-    table_env.execute_sql(
-        create_table(output_table_name, output_stream, output_region, stream_initpos)
-    )
+    table_env.execute_sql(create_sink_table(output_table_name, output_property_map))
 
-    # 4. Queries from the Source Table and creates a tumbling window over 10 seconds to calculate the cumulative PRICE
-    # over the window.
-    tumbling_window_table = perform_tumbling_window_aggregation(input_table_name)
-    table_env.create_temporary_view("tumbling_window_table", tumbling_window_table)
+    # 4. Queries from the Source Table and creates a window per card to calculate count, sum and max of valor
+    #    and/or scores each transaction with the keyed-state velocity rules
+    statement_set = table_env.create_statement_set()
+    if mode in ("window", "both"):
+        resumo = mode == "window" and aggregation_property_map.get("window.type", "tumbling") != "hopping"
+        window_table = perform_window_aggregation(input_table_name, aggregation_property_map, resumo)
+        statement_set.add_insert(output_table_name, window_table)
+    if mode in ("velocity", "both"):
+        # o operador roda nos workers Python e precisa do modulo junto
+        env.add_python_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "velocity.py"))
+        velocity_table = perform_velocity_scoring(table_env, input_table_name, velocity_property_map)
+        statement_set.add_insert(output_table_name, velocity_table)
 
-    # 5. These tumbling windows are inserted into the sink table
-    table_result = table_env.execute_sql("INSERT INTO {0} SELECT * FROM {1}"
-                                         .format(output_table_name, "tumbling_window_table"))
+    # 5. The results are inserted into the sink table
+    table_result = statement_set.execute()
 
     # get job status through TableResult
     print(table_result.get_job_client().get_job_status())
+    return table_result
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    result = main()
+    if os.environ.get(LOCAL_PROPERTIES_ENV):
+        # no MiniCluster local o processo precisa esperar o job terminar
+        result.wait()
\ No newline at end of file
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmark.py
+~~~~~~~~~~~~
+Benchmark local do app.py em um MiniCluster, sem Kinesis.
+
+Gera um application_properties.json temporario trocando a origem e o destino
+(ver create_table/create_sink_table em app.py) e executa o mesmo pipeline:
+    - vazao: origem limitada (datagen com number-of-rows ou JSONL do gerador)
+      e sink blackhole; registros/s = registros / tempo do job
+    - latencia: datagen com taxa fixa e sink print; para cada linha emitida
+      mede a diferenca entre a chegada no stdout e o horario_transacao (nas
+      janelas e o window_end, entao inclui o atraso do watermark)
+    - checkpoints: tamanho dos chk-* gravados em um diretorio local
+
+Uso:
+    python benchmark.py --rows 1000000
+    python benchmark.py --file /tmp/transacoes.jsonl
+    python benchmark.py --latency 60 --rate 2000 --mode velocity
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import monotonic
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+BASE_PROPERTIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "application_properties.json")
+# linhas do sink print: +I[numero_cartao, transaction_id, valor, horario_transacao, ...]
+PRINT_ROW = re.compile(r"[+-][IUD]\[(.*)\]")
+HORARIO = re.compile(r"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(?:\.(\d+))?")
+
+
+def load_groups():
+    with open(BASE_PROPERTIES) as file:
+        return {group["PropertyGroupId"]: dict(group["PropertyMap"]) for group in json.load(file)}
+
+
+def build_properties(args, checkpoints):
+    groups = load_groups()
+    if args.file:
+        groups["consumer.config.0"] = {"connector": "filesystem", "path": args.file}
+    else:
+        groups["consumer.config.0"] = {
+            "connector": "datagen",
+            "rows-per-second": str(args.rate),
+            "cartoes": str(args.cards),
+        }
+        if not args.latency:
+            groups["consumer.config.0"]["number-of-rows"] = str(args.rows)
+    groups["producer.config.0"] = {"connector": "print" if args.latency else "blackhole"}
+    groups["aggregation.config.0"]["mode"] = args.mode
+    tuning = groups.setdefault("tuning.config.0", {})
+    tuning.update({
+        "parallelism": str(args.parallelism),
+        "execution.checkpointing.interval": "{}s".format(args.checkpoint_interval),
+        "state.backend": args.state_backend,
+        "state.checkpoints.dir": "file://" + checkpoints,
+        # mantem os checkpoints no disco depois do job para medir o tamanho
+        "execution.checkpointing.externalized-checkpoint-retention": "RETAIN_ON_CANCELLATION",
+        "state.checkpoints.num-retained": "1000",
+    })
+    return [{"PropertyGroupId": name, "PropertyMap": values} for name, values in groups.items()]
+
+
+def count_lines(path):
+    total = 0
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    for name in paths:
+        with open(name, "rb") as file:
+            total += sum(1 for line in file if line.strip())
+    return total
+
+
+def checkpoint_sizes(directory):
+    sizes = []
+    for root, dirs, files in os.walk(directory):
+        if os.path.basename(root).startswith("chk-"):
+            size = 0
+            for base, _, names in os.walk(root):
+                size += sum(os.path.getsize(os.path.join(base, name)) for name in names)
+            sizes.append((int(os.path.basename(root)[4:]), size))
+    return [size for _, size in sorted(sizes)]
+
+
+def parse_horario(row):
+    # o print omite zeros finais dos milissegundos, entao o parse e manual
+    match = HORARIO.search(row)
+    if not match:
+        return None
+    day, clock, fraction = match.groups()
+    horario = datetime.strptime("{} {}".format(day, clock), "%Y-%m-%d %H:%M:%S")
+    return horario.replace(microsecond=int((fraction or "0")[:6].ljust(6, "0")))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(args, properties_path):
+    env = dict(os.environ, APPLICATION_PROPERTIES_FILE=properties_path)
+    command = [sys.executable, APP]
+    latencies = []
+    emitted = 0
+    start = monotonic()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        for line in process.stdout:
+            match = PRINT_ROW.search(line)
+            if not match:
+                sys.stdout.write(line)
+                continue
+            emitted += 1
+            horario = parse_horario(match.group(1))
+            if horario is None:
+                continue
+            latencies.append((datetime.now() - horario).total_seconds() * 1000)
+            if args.latency and monotonic() - start >= args.latency:
+                break
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+    return monotonic() - start, emitted, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local do pipeline Flink")
+    parser.add_argument("--rows", type=int, default=1000000, help="registros do datagen no teste de vazao")
+    parser.add_argument("--rate", type=int, default=1000000, help="rows-per-second do datagen")
+    parser.add_argument("--cards", type=int, default=1000, help="cartoes distintos no datagen")
+    parser.add_argument("--file", help="JSONL gravado pelo gerador (RECORD_FILE) no lugar do datagen")
+    parser.add_argument("--latency", type=int, default=0, help="segundos de medicao de latencia (sink print)")
+    parser.add_argument("--mode", default="window", choices=["window", "velocity", "both"])
+    parser.add_argument("--parallelism", type=int, default=1)
+    parser.add_argument("--checkpoint-interval", type=int, default=10, help="segundos entre checkpoints")
+    parser.add_argument("--state-backend", default="hashmap", choices=["hashmap", "rocksdb"])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="flink-benchmark-")
+    checkpoints = os.path.join(workdir, "checkpoints")
+    properties_path = os.path.join(workdir, "application_properties.json")
+    with open(properties_path, "w") as file:
+        json.dump(build_properties(args, checkpoints), file, indent=2)
+
+    elapsed, emitted, latencies = run(args, properties_path)
+
+    print("Resultado ({}, paralelismo {}, {})".format(args.mode, args.parallelism, workdir))
+    if not args.latency:
+        records = count_lines(args.file) if args.file else args.rows
+        print("  registros: {} em {:.1f} s ({:.0f} registros/s)".format(records, elapsed, records / elapsed))
+        print("  inclui a subida do MiniCluster; compare execucoes com o mesmo volume")
+    else:
+        print("  linhas emitidas: {} em {:.1f} s".format(emitted, elapsed))
+        if latencies:
+            print("  latencia ms: p50 {:.0f} p95 {:.0f} p99 {:.0f} max {:.0f}".format(
+                percentile(latencies, 50), percentile(latencies, 95),
+                percentile(latencies, 99), max(latencies)
+            ))
+    sizes = checkpoint_sizes(checkpoints)
+    if sizes:
+        print("  checkpoints: {} retidos, ultimo {} bytes, maior {} bytes".format(len(sizes), sizes[-1], max(sizes)))
+    else:
+        print("  checkpoints: nenhum concluido")
+
+
+if __name__ == "__main__":
+    main()
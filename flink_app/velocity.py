@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+velocity.py
+~~~~~~~~~~~
+Score de velocidade por cartao com estado por chave (DataStream API).
+
+Cada transacao atualiza contadores incrementais do cartao e recebe um score
+na hora, sem esperar o fechamento de janela:
+    - transacoes no ultimo minuto (buckets de 10 segundos)
+    - gasto na ultima hora (buckets de 1 minuto)
+    - estados distintos na ultima hora
+O estado de um cartao sem transacoes por state.ttl.minutes e descartado.
+"""
+
+from datetime import datetime
+
+from pyflink.common import Row
+from pyflink.common.typeinfo import Types
+from pyflink.datastream.functions import KeyedProcessFunction
+from pyflink.datastream.state import MapStateDescriptor, ValueStateDescriptor
+
+EPOCH = datetime(1970, 1, 1)
+
+INPUT_TYPE = Types.ROW_NAMED(
+    ['numero_cartao', 'transaction_id', 'valor', 'horario_transacao', 'estado'],
+    [Types.STRING(), Types.STRING(), Types.DOUBLE(), Types.SQL_TIMESTAMP(), Types.STRING()]
+)
+OUTPUT_TYPE = Types.ROW_NAMED(
+    ['numero_cartao', 'transaction_id', 'valor', 'horario_transacao', 'score'],
+    [Types.STRING(), Types.STRING(), Types.DOUBLE(), Types.SQL_TIMESTAMP(), Types.INT()]
+)
+
+
+def roll(buckets, bucket, size, value):
+    '''Soma value no bucket e descarta os que sairam da janela de size buckets.'''
+    buckets[bucket] = buckets.get(bucket, 0) + value
+    for old in [old for old in buckets if old <= bucket - size]:
+        del buckets[old]
+    return buckets, sum(buckets.values())
+
+
+class VelocityScore(KeyedProcessFunction):
+
+    def __init__(self, config):
+        self.max_transacoes_minuto = int(config.get("max.transacoes.minuto", "5"))
+        self.max_gasto_hora = float(config.get("max.gasto.hora", "10000"))
+        self.max_estados_hora = int(config.get("max.estados.hora", "3"))
+        self.valor_alto = float(config.get("valor.alto", "5000"))
+        self.score_threshold = int(config.get("score.threshold", "50"))
+        self.ttl = int(config.get("state.ttl.minutes", "120")) * 60 * 1000
+
+    def open(self, runtime_context):
+        self.minuto = runtime_context.get_state(ValueStateDescriptor("minuto", Types.PICKLED_BYTE_ARRAY()))
+        self.hora = runtime_context.get_state(ValueStateDescriptor("hora", Types.PICKLED_BYTE_ARRAY()))
+        self.estados = runtime_context.get_map_state(MapStateDescriptor("estados", Types.STRING(), Types.LONG()))
+        self.expira = runtime_context.get_state(ValueStateDescriptor("expira", Types.LONG()))
+
+    def process_element(self, value, ctx):
+        numero_cartao, transaction_id, valor, horario, estado = value
+        segundos = int((horario - EPOCH).total_seconds())
+
+        minuto, transacoes_minuto = roll(self.minuto.value() or {}, segundos // 10, 6, 1)
+        self.minuto.update(minuto)
+        hora, gasto_hora = roll(self.hora.value() or {}, segundos // 60, 60, valor)
+        self.hora.update(hora)
+        if estado:
+            self.estados.put(estado, segundos)
+        expirados = [nome for nome, visto in self.estados.items() if visto <= segundos - 3600]
+        for nome in expirados:
+            self.estados.remove(nome)
+        estados_hora = len(list(self.estados.keys()))
+
+        score = 0
+        if transacoes_minuto >= self.max_transacoes_minuto:
+            score += 40
+        if gasto_hora >= self.max_gasto_hora:
+            score += 30
+        if estados_hora >= self.max_estados_hora:
+            score += 30
+        if valor >= self.valor_alto:
+            score += 20
+        score = min(score, 100)
+
+        # TTL do estado: timer de inatividade arredondado ao minuto para
+        # nao registrar um timer por transacao
+        expira = (ctx.timer_service().current_processing_time() + self.ttl) // 60000 * 60000 + 60000
+        if self.expira.value() != expira:
+            self.expira.update(expira)
+            ctx.timer_service().register_processing_time_timer(expira)
+
+        if score >= self.score_threshold:
+            yield Row(numero_cartao, transaction_id, valor, horario, score)
+
+    def on_timer(self, timestamp, ctx):
+        expira = self.expira.value()
+        if expira is not None and timestamp >= expira:
+            self.minuto.clear()
+            self.hora.clear()
+            self.estados.clear()
+            self.expira.clear()
+
+
+def perform_velocity_scoring(table_env, input_table_name, config):
+    stream = table_env.to_append_stream(
+        table_env.sql_query("""
+            SELECT numero_cartao, transaction_id, valor,
+                   CAST(horario_transacao AS TIMESTAMP(3)) AS horario_transacao,
+                   estado
+            FROM {0}
+        """.format(input_table_name)),
+        INPUT_TYPE
+    )
+    scored = stream \
+        .key_by(lambda row: row[0], key_type=Types.STRING()) \
+        .process(VelocityScore(config), output_type=OUTPUT_TYPE)
+    table_env.create_temporary_view("velocity_scored", table_env.from_data_stream(scored))
+    # mesmo formato do sink das janelas: quantidade e maior_valor ficam nulos e
+    # tipo separa as linhas por transacao das linhas por janela
+    return table_env.sql_query("""
+        SELECT
+            numero_cartao,
+            transaction_id,
+            valor,
+            CAST(horario_transacao AS TIMESTAMP(3)) AS horario_transacao,
+            CAST(NULL AS BIGINT) AS quantidade,
+            CAST(NULL AS DOUBLE) AS maior_valor,
+            score,
+            'velocidade' AS tipo,
+            TRUE AS resumo
+        FROM velocity_scored
+    """)
@@ -1,50 +1,109 @@
+import asyncio
 import boto3
 import json
 import random
+import signal
+import threading
 import uuid
+from botocore.exceptions import ClientError
 from datetime import datetime
 from faker import Faker
-from geopy.geocoders import Nominatim
-from time import sleep
-
-
-tipo_transacao = [
-    'credito',
-    'debito'
-]
-
-cor_cartao = [
-    'preto',
-    'prata',
-    'amarelo',
-    'azul',
-    'verde'
-]
-
-tipo_cartao = [
-    'unlimited',
-    'black',
-    'platinum',
-    'gold',
-    'standard'
-]
+from os import environ
+from time import monotonic, sleep
+from dados import (
+    cor_cartao,
+    pesos_cartao,
+    pesos_transacao,
+    tipo_cartao,
+    tipo_transacao
+)
+from engine import GeneratorEngine
+from geocoder import GeoIndex
+from lote import gerar_lote
+from partitioner import ShardMonitor, criar_partitioner
+from producer import RETRYABLE_ERRORS, AdaptiveController, KinesisProducer
+from replay import parse_velocidade, replay
+from scheduler import Scheduler, carregar_config, criar_perfil
+from wire import serialize
+
+
+PRODUCER_MODE = environ.get('PRODUCER_MODE', 'single')
+BATCH_LINGER_MS = int(environ.get('BATCH_LINGER_MS', '100'))
+BATCH_QUEUE_SIZE = int(environ.get('BATCH_QUEUE_SIZE', '10000'))
+BATCH_SIZE = int(environ.get('BATCH_SIZE', '500'))
+GENERATOR_WORKERS = int(environ.get('GENERATOR_WORKERS', '1'))
+METRICS_INTERVAL = float(environ.get('METRICS_INTERVAL', '10'))
+RECORD_FILE = environ.get('RECORD_FILE')
+REPLAY_FILE = environ.get('REPLAY_FILE')
+REPLAY_SPEED = environ.get('REPLAY_SPEED', 'max')
+REPLAY_REBASE = environ.get('REPLAY_REBASE', 'true').lower() == 'true'
+KPL_AGGREGATION = environ.get('KPL_AGGREGATION', 'false').lower() == 'true'
+PARTITIONER = environ.get('PARTITIONER', 'random')
+WIRE_FORMAT = environ.get('WIRE_FORMAT', 'json')
 
 fake = Faker('pt_BR')
-locator = Nominatim(user_agent="bbbank")
+geo_index = GeoIndex()
 
 class KinesisStream:
 
     def __init__(self, kinesis_client):
         self.kinesis_client = kinesis_client
         self.stream_exists_waiter = kinesis_client.get_waiter('stream_exists')
+        self.controller = AdaptiveController()
+        self.monitor = ShardMonitor(kinesis_client, stream_name='card-stream')
+        self.partitioner = criar_partitioner(PARTITIONER, self.monitor)
 
     def put_record(self):
-        self.kinesis_client.put_record(
-            StreamName='card-stream',
-            Data=json.dumps(gerador_transacoes()),
-            PartitionKey=str(uuid.uuid4())
+        transacao = gerador_transacoes()
+        entry = {'Data': serialize(transacao, WIRE_FORMAT)}
+        entry['PartitionKey'], explicit_hash_key = self.partitioner(transacao)
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        for attempt in range(1, self.controller.max_retries + 1):
+            try:
+                response = self.kinesis_client.put_record(StreamName='card-stream', **entry)
+                self.monitor.registrar([entry], {'Records': [response]})
+                return
+            except ClientError as error:
+                if error.response.get('Error', {}).get('Code') not in RETRYABLE_ERRORS:
+                    raise
+                sleep(self.controller.backoff(attempt))
+        print(f"PutRecord: registro descartado apos {self.controller.max_retries} tentativas")
+
+
+class KinesisBatchStream:
+
+    def __init__(self, kinesis_client, gravacao=None):
+        # grava o que foi publicado em JSONL para replay posterior
+        self.gravacao = open(gravacao, 'ab') if gravacao else None
+        self.monitor = ShardMonitor(kinesis_client, stream_name='card-stream')
+        self.partitioner = criar_partitioner(PARTITIONER, self.monitor)
+        self.producer = KinesisProducer(
+            kinesis_client,
+            stream_name='card-stream',
+            linger_ms=BATCH_LINGER_MS,
+            queue_size=BATCH_QUEUE_SIZE,
+            aggregate=KPL_AGGREGATION,
+            monitor=self.monitor
         )
 
+    def put_lote(self, n):
+        for transacao in gerar_lote(n):
+            data = serialize(transacao, WIRE_FORMAT)
+            self.producer.put(data, *self.partitioner(transacao))
+            if self.gravacao:
+                # a gravacao e sempre JSONL, independente do formato no stream
+                if WIRE_FORMAT != 'json':
+                    data = json.dumps(transacao).encode('utf-8')
+                self.gravacao.write(data + b'\n')
+
+    def close(self):
+        try:
+            self.producer.close()
+        finally:
+            if self.gravacao:
+                self.gravacao.close()
+
 def gerar_cpf():
     cpf = [random.randrange(10) for _ in range(9)]
     for _ in range(2):
@@ -56,9 +115,7 @@ def gerador_transacoes():
     start = datetime(2022,1,1)
     end = datetime(2040,1,1)
     geo = fake.local_latlng('BR')
-    latlng = f"{geo[0]},{geo[1]}"
-    location = locator.reverse(latlng, exactly_one=True)
-    location = location.raw.get('address')
+    location = geo_index.reverse(geo[0], geo[1])
     transacao = {
         "nome": fake.name(),
         "cpf": fake.cpf(),
@@ -67,14 +124,14 @@ def gerador_transacoes():
         "numero_cartao": fake.credit_card_number(),
         "cvv": fake.credit_card_security_code(),
         "exp": fake.credit_card_expire(start, end),
-        "tipo_cartao": random.choices(population=tipo_cartao, weights=[5,15,20,25,35])[0],
-        "cor_cartao": random.choices(population=cor_cartao, weights=[5,15,20,25,35])[0],
-        "tipo_transacao": random.choices(population=tipo_transacao, weights=[65,35])[0],
+        "tipo_cartao": random.choices(population=tipo_cartao, weights=pesos_cartao)[0],
+        "cor_cartao": random.choices(population=cor_cartao, weights=pesos_cartao)[0],
+        "tipo_transacao": random.choices(population=tipo_transacao, weights=pesos_transacao)[0],
         "localizacao": {
             'lat': geo[0],
             'lng': geo[1],
             'cidade': geo[2],
-            'estado': location['state']
+            'estado': location['estado']
         },
         "horario_transacao": datetime.now().isoformat(),
         "transaction_id": str(uuid.uuid4())
@@ -82,14 +139,79 @@ def gerador_transacoes():
     print(f"Transacao enviada: {transacao['valor']}")
     return transacao
 
+def produzir(indice, parar, reportar):
+    print(f"Worker {indice}: iniciando")
+    gravacao = RECORD_FILE
+    if gravacao and GENERATOR_WORKERS > 1:
+        gravacao = f"{RECORD_FILE}.{indice}"
+    cliente = KinesisBatchStream(boto3.client('kinesis'), gravacao)
+    config = carregar_config()
+    ultimo = ultimo_log = monotonic()
+
+    def enviar(n):
+        nonlocal ultimo, ultimo_log
+        cliente.put_lote(n)
+        agora = monotonic()
+        if agora - ultimo >= 1:
+            reportar(cliente.producer.metrics())
+            ultimo = agora
+        if agora - ultimo_log >= METRICS_INTERVAL:
+            # reenvios, descartes, fila e limites do AIMD, em qualquer numero de workers
+            m = cliente.producer.metrics()
+            taxa = 'livre' if m['rate_limit'] is None else f"{m['rate_limit']:.0f}/s"
+            print(
+                f"Worker {indice}: {m['records']} registros em {m['entries']} entradas, reenvios={m['retries']} "
+                f"throttled={m['throttled']} descartados={m['failed']} fila={m['queue']} "
+                f"lote={m['batch_limit']} taxa={taxa}"
+            )
+            ultimo_log = agora
+
+    try:
+        if config is None:
+            while not parar.is_set():
+                enviar(BATCH_SIZE)
+        else:
+            # cada worker recebe uma fracao igual da taxa alvo
+            escala = 1 / GENERATOR_WORKERS
+            scheduler = Scheduler(
+                criar_perfil(config, escala),
+                enviar,
+                arquivo=environ.get('LOAD_PROFILE_FILE'),
+                escala=escala,
+                parar=parar
+            )
+            asyncio.run(scheduler.run())
+    finally:
+        cliente.close()
+        reportar(cliente.producer.metrics())
+
 def thread_function(name):
     print("Thread %s: starting", name)
+    if PRODUCER_MODE == 'batch' and GENERATOR_WORKERS > 1:
+        GeneratorEngine(produzir, workers=GENERATOR_WORKERS).run()
+        return
+    if PRODUCER_MODE == 'batch':
+        parar = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: parar.set())
+        produzir(0, parar, lambda stats: None)
+        return
+    if PRODUCER_MODE == 'replay':
+        parar = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: parar.set())
+        cliente = KinesisBatchStream(boto3.client('kinesis'))
+        try:
+            replay(
+                REPLAY_FILE, cliente.producer, parse_velocidade(REPLAY_SPEED), REPLAY_REBASE, parar,
+                partitioner=cliente.partitioner
+            )
+        finally:
+            cliente.close()
+        return
     kinesis_client = boto3.client('kinesis')
     cliente = KinesisStream(kinesis_client)
     while True:
         cliente.put_record()
         sleep(1)
 
-
 if __name__ == "__main__":
     thread_function('xap')
\ No newline at end of file
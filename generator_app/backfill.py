@@ -0,0 +1,196 @@
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from time import monotonic
+
+import numpy as np
+
+from lote import CAMPOS, GeradorLote
+
+# Gera historico no mesmo layout que o Firehose do HistoricalAnalytics grava:
+# raw/estado=<estado>/<nome>-1-<yyyy-MM-dd-HH-mm-ss>-<uuid>.gz, com um JSON por
+# linha comprimido em GZIP.
+
+NAMESPACE = uuid.UUID('5f1d3c4e-7a0b-4f6e-9c1d-2b8a6e4f0a11')
+TAMANHO_LOTE = 50000
+# bytes sem compressao entre verificacoes do tamanho do objeto
+BLOCO_BYTES = 64 * 1024
+
+_gerador = None
+
+
+def _iniciar_worker(seed, tamanho_pool):
+    global _gerador
+    _gerador = GeradorLote(seed=seed, tamanho_pool=tamanho_pool)
+
+
+class Destino:
+    '''Grava no diretorio local ou, para s3://bucket/prefixo, envia via boto3.'''
+
+    def __init__(self, destino, endpoint_url=None):
+        self.s3 = destino.startswith('s3://')
+        if self.s3:
+            import boto3
+            self.bucket, _, self.prefixo = destino[len('s3://'):].partition('/')
+            self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        else:
+            self.prefixo = destino
+
+    def abrir(self, chave):
+        if self.s3:
+            return tempfile.NamedTemporaryFile(suffix='.gz', delete=False)
+        caminho = os.path.join(self.prefixo, chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        return open(caminho, 'wb')
+
+    def concluir(self, arquivo, chave):
+        arquivo.close()
+        if self.s3:
+            self.client.upload_file(arquivo.name, self.bucket, '/'.join(filter(None, [self.prefixo.rstrip('/'), chave])))
+            os.unlink(arquivo.name)
+
+
+class Particao:
+    '''Arquivos GZIP de um estado, rotacionados ao atingir o tamanho alvo.'''
+
+    def __init__(self, destino, estado, nome, horario, tamanho_alvo, semente):
+        self.destino = destino
+        self.estado = estado
+        self.nome = nome
+        self.horario = horario
+        self.tamanho_alvo = tamanho_alvo
+        self.semente = semente
+        self.parte = 0
+        self.arquivos = []
+        self.bruto = None
+
+    def _abrir(self):
+        identificador = uuid.uuid5(NAMESPACE, f"{self.semente}-{self.estado}-{self.parte}")
+        self.chave = f"raw/estado={self.estado}/{self.nome}-1-{self.horario:%Y-%m-%d-%H-%M-%S}-{identificador}.gz"
+        self.bruto = self.destino.abrir(self.chave)
+        self.gz = gzip.GzipFile(fileobj=self.bruto, mode='wb', compresslevel=6, mtime=0)
+        self.parte += 1
+
+    def escrever(self, dados):
+        # escreve em blocos terminados em linha completa e esvazia o zlib antes
+        # de medir: o tell() nao conta o que ainda esta no buffer do compressor
+        inicio = 0
+        while inicio < len(dados):
+            if self.bruto is None:
+                self._abrir()
+            fim = dados.find(b'\n', min(inicio + BLOCO_BYTES, len(dados)) - 1) + 1 or len(dados)
+            self.gz.write(dados[inicio:fim])
+            self.gz.flush(zlib.Z_SYNC_FLUSH)
+            inicio = fim
+            if self.bruto.tell() >= self.tamanho_alvo:
+                self.fechar()
+
+    def fechar(self):
+        if self.bruto is not None:
+            self.gz.close()
+            self.destino.concluir(self.bruto, self.chave)
+            self.arquivos.append(self.chave)
+            self.bruto = None
+
+
+def gerar_fatia(tarefa, inicio, fim, registros, destino, endpoint_url, nome, seed, tamanho_alvo):
+    '''Gera os registros de [inicio, fim) com semente propria da tarefa.'''
+    _gerador.rng = np.random.default_rng([seed, tarefa])
+    destino = Destino(destino, endpoint_url)
+    particoes = {}
+    inicio64 = np.datetime64(inicio, 'us')
+    intervalo = int((fim - inicio) / timedelta(microseconds=1))
+
+    restantes = registros
+    bytes_escritos = 0
+    while restantes > 0:
+        n = min(restantes, TAMANHO_LOTE)
+        restantes -= n
+        colunas = _gerador.colunas(n)
+        deslocamentos = np.sort(_gerador.rng.integers(0, intervalo, size=n))
+        colunas['horario_transacao'] = np.datetime_as_string(inicio64 + deslocamentos.astype('timedelta64[us]'))
+        valores = [colunas[campo].tolist() for campo in CAMPOS]
+
+        por_estado = {}
+        for linha in zip(*valores):
+            registro = dict(zip(CAMPOS, linha))
+            por_estado.setdefault(registro['localizacao']['estado'], []).append(json.dumps(registro))
+        for estado, linhas in por_estado.items():
+            if estado not in particoes:
+                particoes[estado] = Particao(destino, estado, nome, inicio, tamanho_alvo, f"{seed}-{tarefa}")
+            dados = ('\n'.join(linhas) + '\n').encode('utf-8')
+            bytes_escritos += len(dados)
+            particoes[estado].escrever(dados)
+
+    arquivos = []
+    for particao in particoes.values():
+        particao.fechar()
+        arquivos.extend(particao.arquivos)
+    return registros, bytes_escritos, len(arquivos)
+
+
+def fatias(inicio, fim, horas):
+    atual = inicio
+    while atual < fim:
+        proximo = min(atual + timedelta(hours=horas), fim)
+        yield atual, proximo
+        atual = proximo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera historico de transacoes no layout raw/estado=<estado>/ do Firehose')
+    parser.add_argument('destino', help='diretorio local ou s3://bucket/prefixo')
+    parser.add_argument('--inicio', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--fim', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--tps', type=float, default=100, help='taxa media de transacoes por segundo no periodo')
+    parser.add_argument('--fatia-horas', type=float, default=24, help='periodo gerado por tarefa')
+    parser.add_argument('--tamanho-mb', type=float, default=128, help='tamanho alvo de cada objeto comprimido')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--pool', type=int, default=5000, help='tamanho dos pools de nomes e cartoes')
+    parser.add_argument('--nome', default='backfill', help='prefixo do nome dos objetos')
+    parser.add_argument('--endpoint-url', help='endpoint S3 alternativo (MinIO, LocalStack)')
+    args = parser.parse_args()
+
+    inicio = monotonic()
+    total = bytes_total = objetos = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_iniciar_worker,
+        initargs=(args.seed, args.pool)
+    ) as executor:
+        futuros = [
+            executor.submit(
+                gerar_fatia,
+                tarefa,
+                de,
+                ate,
+                round(args.tps * (ate - de).total_seconds()),
+                args.destino,
+                args.endpoint_url,
+                args.nome,
+                args.seed,
+                int(args.tamanho_mb * 1024 * 1024)
+            )
+            for tarefa, (de, ate) in enumerate(fatias(args.inicio, args.fim, args.fatia_horas))
+        ]
+        for futuro in futuros:
+            registros, bytes_escritos, arquivos = futuro.result()
+            total += registros
+            bytes_total += bytes_escritos
+            objetos += arquivos
+            duracao = monotonic() - inicio
+            print(
+                f"Backfill: {total} registros, {bytes_total / 1024 ** 3:.2f} GB em {objetos} objetos "
+                f"({total / duracao:.0f} registros/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import io
+import json
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from app import gerador_transacoes
+from lote import GeradorLote
+from wire import decode, encode
+
+
+def medir(nome, funcao, registros):
+    inicio = perf_counter()
+    with redirect_stdout(io.StringIO()):
+        funcao()
+    duracao = perf_counter() - inicio
+    print(f"{nome:<28} {registros:>9} registros {duracao:8.3f}s {registros / duracao:12.0f} registros/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara a geracao registro a registro com a geracao em lote')
+    parser.add_argument('-n', type=int, default=100000, help='registros por medicao')
+    parser.add_argument('--unitario', type=int, default=5000, help='registros medidos em gerador_transacoes')
+    args = parser.parse_args()
+
+    gerador = GeradorLote(seed=42)
+
+    medir('gerador_transacoes', lambda: [gerador_transacoes() for _ in range(args.unitario)], args.unitario)
+    medir('GeradorLote.colunas', lambda: gerador.colunas(args.n), args.n)
+    medir('GeradorLote.registros', lambda: gerador.registros(args.n), args.n)
+
+    registros = gerador.registros(args.n)
+    em_json = [json.dumps(registro).encode('utf-8') for registro in registros]
+    em_binario = [encode(registro) for registro in registros]
+    tamanho_json = sum(map(len, em_json)) / args.n
+    tamanho_binario = sum(map(len, em_binario)) / args.n
+    print(
+        f"Tamanho medio: json {tamanho_json:.0f} bytes, binario {tamanho_binario:.0f} bytes "
+        f"({tamanho_json / tamanho_binario:.1f}x menor)"
+    )
+    medir('json.dumps', lambda: [json.dumps(registro) for registro in registros], args.n)
+    medir('wire.encode', lambda: [encode(registro) for registro in registros], args.n)
+    medir('json.loads', lambda: [json.loads(dado) for dado in em_json], args.n)
+    medir('wire.decode', lambda: [decode(dado) for dado in em_binario], args.n)
+
+
+if __name__ == "__main__":
+    main()
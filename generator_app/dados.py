@@ -0,0 +1,23 @@
+tipo_transacao = [
+    'credito',
+    'debito'
+]
+
+cor_cartao = [
+    'preto',
+    'prata',
+    'amarelo',
+    'azul',
+    'verde'
+]
+
+tipo_cartao = [
+    'unlimited',
+    'black',
+    'platinum',
+    'gold',
+    'standard'
+]
+
+pesos_cartao = [5, 15, 20, 25, 35]
+pesos_transacao = [65, 35]
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import queue
+import signal
+from time import monotonic
+
+# queue e a profundidade atual da fila de cada worker; somada, a fila total
+CONTADORES = ('records', 'entries', 'requests', 'bytes', 'failed', 'retries', 'throttled', 'queue')
+
+
+def _executar(target, indice, parar, fila_stats):
+    # o processo principal coordena o encerramento; o worker so observa o evento
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    def reportar(stats):
+        fila_stats.put((indice, dict(stats)))
+
+    target(indice, parar, reportar)
+
+
+class GeneratorEngine:
+    '''Distribui a geracao de transacoes em um processo por nucleo.
+
+    target(indice, parar, reportar) roda em cada worker: deve criar o proprio
+    Faker e cliente Kinesis, produzir ate parar.is_set() e chamar reportar()
+    com os contadores acumulados do seu producer.
+    '''
+
+    def __init__(self, target, workers=None, intervalo=10):
+        self.target = target
+        self.workers = workers or os.cpu_count() or 1
+        self.intervalo = intervalo
+        contexto = multiprocessing.get_context('spawn')
+        self.parar = contexto.Event()
+        self.fila_stats = contexto.Queue()
+        self.processos = [
+            contexto.Process(
+                target=_executar,
+                args=(target, indice, self.parar, self.fila_stats),
+                name=f'gerador-{indice}'
+            )
+            for indice in range(self.workers)
+        ]
+        self.stats = {indice: dict.fromkeys(CONTADORES, 0) for indice in range(self.workers)}
+
+    def stop(self, *_):
+        self.parar.set()
+
+    def total(self):
+        return {
+            contador: sum(stats[contador] for stats in self.stats.values())
+            for contador in CONTADORES
+        }
+
+    def _consumir_stats(self, timeout):
+        try:
+            indice, stats = self.fila_stats.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self.stats[indice].update(stats)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for processo in self.processos:
+            processo.start()
+        print(f"Engine: {self.workers} workers iniciados")
+
+        inicio = ultimo = monotonic()
+        anterior = 0
+        while any(processo.is_alive() for processo in self.processos):
+            self._consumir_stats(timeout=1)
+            agora = monotonic()
+            if agora - ultimo >= self.intervalo:
+                total = self.total()
+                por_worker = ' '.join(
+                    f"{indice}:{stats['records']}" for indice, stats in sorted(self.stats.items())
+                )
+                print(
+                    f"Engine: {(total['records'] - anterior) / (agora - ultimo):.0f} registros/s "
+                    f"total={total['records']} reenvios={total['retries']} throttled={total['throttled']} "
+                    f"descartados={total['failed']} fila={total['queue']} workers=[{por_worker}]"
+                )
+                anterior, ultimo = total['records'], agora
+
+        # esvazia os contadores finais enviados pelos workers no encerramento
+        while True:
+            try:
+                indice, stats = self.fila_stats.get(timeout=0.1)
+            except queue.Empty:
+                break
+            self.stats[indice].update(stats)
+        total = self.total()
+        duracao = monotonic() - inicio
+        print(f"Engine: encerrado com {total['records']} registros em {duracao:.0f}s ({total['records'] / duracao:.0f} registros/s)")
+        return total
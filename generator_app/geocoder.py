@@ -0,0 +1,161 @@
+import csv
+import math
+import mmap
+import struct
+import sys
+from functools import lru_cache
+from os import path
+
+# Indice espacial offline para geocodificacao reversa lat/lng -> estado/cidade.
+#
+# Layout do arquivo (little-endian):
+#   cabecalho   MAGIC, n_pontos, n_textos, lat_min, lng_min, celula, linhas, colunas
+#   celulas     uint32[linhas * colunas + 1] com o primeiro ponto de cada celula
+#   pontos      (int32 lat, int32 lng, uint16 estado, uint16 cidade) ordenados por celula
+#   textos      uint32[n_textos + 1] de offsets seguidos dos textos em utf-8
+# Coordenadas sao gravadas em micrograus.
+
+MAGIC = b'BBGEO1\x00\x00'
+HEADER = struct.Struct('<8sIIiiiHH')
+POINT = struct.Struct('<iiHH')
+OFFSET = struct.Struct('<I')
+MICRO = 1_000_000
+
+BASE_DIR = path.dirname(path.abspath(__file__))
+POINTS_FILE = path.join(BASE_DIR, 'geo_br.csv')
+INDEX_FILE = path.join(BASE_DIR, 'geo_br.idx')
+
+
+def build_index(points, filename, cell_degrees=1.0):
+    '''Grava o indice a partir de tuplas (lat, lng, estado, cidade).'''
+    textos = {}
+
+    def texto(valor):
+        return textos.setdefault(valor, len(textos))
+
+    cell = int(cell_degrees * MICRO)
+    coords = [
+        (round(float(lat) * MICRO), round(float(lng) * MICRO), texto(estado), texto(cidade))
+        for lat, lng, estado, cidade in points
+    ]
+    lat_min = min(c[0] for c in coords)
+    lng_min = min(c[1] for c in coords)
+    rows = (max(c[0] for c in coords) - lat_min) // cell + 1
+    cols = (max(c[1] for c in coords) - lng_min) // cell + 1
+
+    def cell_of(c):
+        return ((c[0] - lat_min) // cell) * cols + (c[1] - lng_min) // cell
+
+    coords.sort(key=cell_of)
+    offsets = [0] * (rows * cols + 1)
+    for c in coords:
+        offsets[cell_of(c) + 1] += 1
+    for i in range(1, len(offsets)):
+        offsets[i] += offsets[i - 1]
+
+    blobs = [t.encode('utf-8') for t in textos]
+    text_offsets = [0]
+    for blob in blobs:
+        text_offsets.append(text_offsets[-1] + len(blob))
+
+    with open(filename, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, len(coords), len(blobs), lat_min, lng_min, cell, rows, cols))
+        out.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        for c in coords:
+            out.write(POINT.pack(*c))
+        out.write(struct.pack(f'<{len(text_offsets)}I', *text_offsets))
+        out.write(b''.join(blobs))
+
+
+class GeoIndex:
+    '''Consulta o indice mapeado em memoria pelo ponto mais proximo.'''
+
+    def __init__(self, filename=INDEX_FILE):
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_points, self.n_texts, self.lat_min, self.lng_min,
+         self.cell, self.rows, self.cols) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'Arquivo de indice invalido: {filename}')
+        self.cells_at = HEADER.size
+        self.points_at = self.cells_at + (self.rows * self.cols + 1) * OFFSET.size
+        self.texts_at = self.points_at + self.n_points * POINT.size
+        self.blob_at = self.texts_at + (self.n_texts + 1) * OFFSET.size
+        self.texts = [self._text(i) for i in range(self.n_texts)]
+        self.reverse = lru_cache(maxsize=65536)(self._reverse)
+
+    def _text(self, i):
+        start, end = struct.unpack_from('<II', self.mm, self.texts_at + i * OFFSET.size)
+        return self.mm[self.blob_at + start:self.blob_at + end].decode('utf-8')
+
+    def _cell_range(self, row, col):
+        i = row * self.cols + col
+        return struct.unpack_from('<II', self.mm, self.cells_at + i * OFFSET.size)
+
+    def _reverse(self, lat, lng):
+        lat = round(float(lat) * MICRO)
+        lng = round(float(lng) * MICRO)
+        scale = math.cos(math.radians(lat / MICRO))
+        row = min(max((lat - self.lat_min) // self.cell, 0), self.rows - 1)
+        col = min(max((lng - self.lng_min) // self.cell, 0), self.cols - 1)
+
+        best, best_dist = None, math.inf
+        for ring in range(max(self.rows, self.cols)):
+            # nenhum ponto no anel seguinte pode estar mais proximo que o atual
+            if best is not None and best_dist <= ((ring - 1) * self.cell * scale) ** 2:
+                break
+            for r in range(row - ring, row + ring + 1):
+                if r < 0 or r >= self.rows:
+                    continue
+                step = 1 if r in (row - ring, row + ring) else 2 * ring or 1
+                for c in range(col - ring, col + ring + 1, step):
+                    if c < 0 or c >= self.cols:
+                        continue
+                    start, end = self._cell_range(r, c)
+                    for i in range(start, end):
+                        p_lat, p_lng, estado, cidade = POINT.unpack_from(self.mm, self.points_at + i * POINT.size)
+                        dist = (p_lat - lat) ** 2 + ((p_lng - lng) * scale) ** 2
+                        if dist < best_dist:
+                            best, best_dist = (estado, cidade), dist
+        if best is None:
+            return None
+        return {'estado': self.texts[best[0]], 'cidade': self.texts[best[1]]}
+
+
+def load_points(filename=POINTS_FILE):
+    with open(filename, newline='', encoding='utf-8') as f:
+        return [(row['lat'], row['lng'], row['estado'], row['cidade']) for row in csv.DictReader(f)]
+
+
+def refresh_points(filename=POINTS_FILE):
+    '''Regrava a tabela de pontos consultando o Nominatim uma vez por coordenada do Faker.'''
+    from faker.providers.geo import Provider
+    from geopy.extra.rate_limiter import RateLimiter
+    from geopy.geocoders import Nominatim
+
+    locator = Nominatim(user_agent="bbbank")
+    reverse = RateLimiter(locator.reverse, min_delay_seconds=1)
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['lat', 'lng', 'estado', 'cidade'])
+        for lat, lng, cidade, country, _ in Provider.land_coords:
+            if country != 'BR':
+                continue
+            address = reverse(f"{lat},{lng}", exactly_one=True).raw.get('address')
+            writer.writerow([lat, lng, address['state'], cidade])
+            print(f"{cidade}: {address['state']}")
+
+
+def main(command='build', source=POINTS_FILE, target=INDEX_FILE):
+    if command == 'nominatim':
+        refresh_points(source)
+    elif command == 'build':
+        points = load_points(source)
+        build_index(points, target)
+        print(f"Indice gravado em {target} com {len(points)} pontos")
+    else:
+        raise SystemExit(f"Comando desconhecido: {command} (use build ou nominatim)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1 @@
+../lambda_app/shared/python/kpl.py
\ No newline at end of file
@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import numpy as np
+from faker import Faker
+from faker.providers.geo import Provider as GeoProvider
+
+from dados import (
+    cor_cartao,
+    pesos_cartao,
+    pesos_transacao,
+    tipo_cartao,
+    tipo_transacao
+)
+from geocoder import GeoIndex
+
+CAMPOS = [
+    'nome', 'cpf', 'valor', 'bandeira', 'numero_cartao', 'cvv', 'exp',
+    'tipo_cartao', 'cor_cartao', 'tipo_transacao', 'localizacao',
+    'horario_transacao', 'transaction_id'
+]
+
+PESOS_CPF_1 = np.arange(10, 1, -1)
+PESOS_CPF_2 = np.arange(11, 1, -1)
+HEX = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+UUID_POSICOES = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def _probabilidades(pesos):
+    pesos = np.asarray(pesos, dtype=np.float64)
+    return pesos / pesos.sum()
+
+
+def _texto(matriz):
+    # matriz uint8 (n, largura) de caracteres ASCII -> array de str
+    largura = matriz.shape[1]
+    return np.ascontiguousarray(matriz).view(f'S{largura}').ravel().astype(f'U{largura}')
+
+
+def _digito_cpf(digitos, pesos):
+    resto = (digitos * pesos).sum(axis=1) % 11
+    return np.where(resto > 1, 11 - resto, 0)
+
+
+class GeradorLote:
+    '''Gera transacoes em lote, coluna a coluna, com NumPy.
+
+    Nomes, cartoes e localizacoes sao sorteados de pools gerados uma unica
+    vez com o Faker; as demais colunas sao calculadas de forma vetorizada.
+    '''
+
+    def __init__(self, seed=None, tamanho_pool=5000, geo_index=None):
+        self.rng = np.random.default_rng(seed)
+        fake = Faker('pt_BR')
+        if seed is not None:
+            fake.seed_instance(seed)
+        start = datetime(2022, 1, 1)
+        end = datetime(2040, 1, 1)
+
+        self.nomes = np.array([fake.name() for _ in range(tamanho_pool)], dtype=object)
+        cartoes = [
+            (
+                fake.credit_card_provider(),
+                fake.credit_card_number(),
+                fake.credit_card_security_code(),
+                fake.credit_card_expire(start, end)
+            )
+            for _ in range(tamanho_pool)
+        ]
+        self.bandeiras, self.numeros, self.cvvs, self.exps = (
+            np.array(coluna, dtype=object) for coluna in zip(*cartoes)
+        )
+
+        geo_index = geo_index or GeoIndex()
+        self.localizacoes = np.array([
+            {'lat': lat, 'lng': lng, 'cidade': cidade, 'estado': geo_index.reverse(lat, lng)['estado']}
+            for lat, lng, cidade, country, _ in GeoProvider.land_coords
+            if country == 'BR'
+        ], dtype=object)
+
+        self.p_cartao = _probabilidades(pesos_cartao)
+        self.p_transacao = _probabilidades(pesos_transacao)
+        self.tipo_cartao = np.array(tipo_cartao, dtype=object)
+        self.cor_cartao = np.array(cor_cartao, dtype=object)
+        self.tipo_transacao = np.array(tipo_transacao, dtype=object)
+
+    def cpfs(self, n):
+        digitos = self.rng.integers(0, 10, size=(n, 11), dtype=np.int64)
+        digitos[:, 9] = _digito_cpf(digitos[:, :9], PESOS_CPF_1)
+        digitos[:, 10] = _digito_cpf(digitos[:, :10], PESOS_CPF_2)
+        # formato XXX.XXX.XXX-XX, o mesmo de fake.cpf()
+        texto = np.empty((n, 14), dtype=np.uint8)
+        texto[:, [3, 7]] = ord('.')
+        texto[:, 11] = ord('-')
+        texto[:, [0, 1, 2, 4, 5, 6, 8, 9, 10, 12, 13]] = digitos + ord('0')
+        return _texto(texto)
+
+    def transaction_ids(self, n):
+        brutos = self.rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+        brutos[:, 6] = brutos[:, 6] & 0x0f | 0x40
+        brutos[:, 8] = brutos[:, 8] & 0x3f | 0x80
+        nibbles = np.empty((n, 32), dtype=np.uint8)
+        nibbles[:, 0::2] = brutos >> 4
+        nibbles[:, 1::2] = brutos & 0x0f
+        texto = np.full((n, 36), ord('-'), dtype=np.uint8)
+        texto[:, UUID_POSICOES] = HEX[nibbles]
+        return _texto(texto)
+
+    def colunas(self, n):
+        cartao = self.rng.integers(0, len(self.numeros), size=n)
+        return {
+            'nome': self.nomes[self.rng.integers(0, len(self.nomes), size=n)],
+            'cpf': self.cpfs(n),
+            'valor': np.round(self.rng.uniform(1, 9999, size=n), 2),
+            'bandeira': self.bandeiras[cartao],
+            'numero_cartao': self.numeros[cartao],
+            'cvv': self.cvvs[cartao],
+            'exp': self.exps[cartao],
+            'tipo_cartao': self.rng.choice(self.tipo_cartao, size=n, p=self.p_cartao),
+            'cor_cartao': self.rng.choice(self.cor_cartao, size=n, p=self.p_cartao),
+            'tipo_transacao': self.rng.choice(self.tipo_transacao, size=n, p=self.p_transacao),
+            'localizacao': self.localizacoes[self.rng.integers(0, len(self.localizacoes), size=n)],
+            'horario_transacao': np.full(n, datetime.now().isoformat(), dtype=object),
+            'transaction_id': self.transaction_ids(n),
+        }
+
+    def registros(self, n):
+        colunas = self.colunas(n)
+        valores = [colunas[campo].tolist() for campo in CAMPOS]
+        return [dict(zip(CAMPOS, linha)) for linha in zip(*valores)]
+
+
+_gerador = None
+
+
+def gerar_lote(n, colunar=False):
+    '''Gera n transacoes como lista de dicts ou, com colunar=True, como dict de arrays.'''
+    global _gerador
+    if _gerador is None:
+        _gerador = GeradorLote()
+    return _gerador.colunas(n) if colunar else _gerador.registros(n)
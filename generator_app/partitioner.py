@@ -0,0 +1,134 @@
+import bisect
+import hashlib
+import uuid
+from time import monotonic
+
+# Limites de escrita por shard do Kinesis Data Streams
+SHARD_MAX_RECORDS = 1000
+SHARD_MAX_BYTES = 1024 * 1024
+
+
+def hash_key(partition_key):
+    # o Kinesis mapeia a chave de particao pelo MD5 em um inteiro de 128 bits
+    return int.from_bytes(hashlib.md5(partition_key.encode('utf-8')).digest(), 'big')
+
+
+class ShardMonitor:
+    '''Mantem o mapa de hash keys dos shards abertos e contadores por shard.
+
+    Os contadores vem do ShardId devolvido pelo PutRecords; o mapa e usado
+    para prever o shard de um registro antes do envio (agregacao KPL por
+    shard e particionamento por explicit hash key).
+    '''
+
+    def __init__(self, kinesis_client, stream_name='card-stream', atualizar_a_cada=60, intervalo=10, limiar=0.8):
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.atualizar_a_cada = atualizar_a_cada
+        self.intervalo = intervalo
+        self.limiar = limiar
+        self.contadores = {}
+        self.janela = {}
+        self.inicio_janela = monotonic()
+        self.atualizado = None
+        self.atualizar()
+
+    def atualizar(self):
+        shards = []
+        kwargs = {'StreamName': self.stream_name}
+        while True:
+            response = self.kinesis_client.list_shards(**kwargs)
+            for shard in response['Shards']:
+                # shards fechados por resharding nao recebem mais escritas
+                if 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {}):
+                    continue
+                faixa = shard['HashKeyRange']
+                shards.append((int(faixa['StartingHashKey']), int(faixa['EndingHashKey']), shard['ShardId']))
+            if not response.get('NextToken'):
+                break
+            kwargs = {'NextToken': response['NextToken']}
+        shards.sort()
+        # troca atomica: o mapa e lido pelo gerador e pela thread do producer
+        self.mapa = (shards, [shard[0] for shard in shards])
+        self.atualizado = monotonic()
+
+    def abertos(self):
+        if monotonic() - self.atualizado >= self.atualizar_a_cada:
+            self.atualizar()
+        return self.mapa
+
+    def shard_de(self, partition_key, explicit_hash_key=None):
+        shards, inicios = self.abertos()
+        chave = int(explicit_hash_key) if explicit_hash_key is not None else hash_key(partition_key)
+        return shards[bisect.bisect_right(inicios, chave) - 1][2]
+
+    def registrar(self, batch, response):
+        for entry, resultado in zip(batch, response['Records']):
+            shard = resultado.get('ShardId')
+            if shard is None:
+                continue
+            tamanho = len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
+            for contadores in (self.contadores, self.janela):
+                atual = contadores.setdefault(shard, {'records': 0, 'bytes': 0})
+                atual['records'] += 1
+                atual['bytes'] += tamanho
+        if monotonic() - self.inicio_janela >= self.intervalo:
+            self.verificar()
+
+    def verificar(self):
+        duracao = monotonic() - self.inicio_janela
+        quentes = []
+        for shard, contadores in sorted(self.janela.items()):
+            records = contadores['records'] / duracao
+            bytes_s = contadores['bytes'] / duracao
+            if records >= SHARD_MAX_RECORDS * self.limiar or bytes_s >= SHARD_MAX_BYTES * self.limiar:
+                quentes.append(f"{shard} {records:.0f} registros/s {bytes_s / 1024:.0f} KiB/s")
+        if quentes:
+            print(f"Shards quentes em {self.stream_name}: {'; '.join(quentes)}")
+        self.janela = {}
+        self.inicio_janela = monotonic()
+        return quentes
+
+
+class RandomPartitioner:
+    '''Chave aleatoria: distribui uniformemente, sem ordem por cartao.'''
+
+    def __call__(self, transacao):
+        return str(uuid.uuid4()), None
+
+
+class CardHashPartitioner:
+    '''Chave pelo numero do cartao: mesmo cartao sempre no mesmo shard, em ordem.'''
+
+    def __call__(self, transacao):
+        return str(transacao['numero_cartao']), None
+
+
+class ExplicitHashPartitioner:
+    '''Distribui os cartoes igualmente entre os shards abertos via ExplicitHashKey.
+
+    Cada cartao e fixado em um shard (hash do cartao modulo o numero de
+    shards) e recebe o ponto medio da faixa desse shard, evitando o
+    desbalanceamento do MD5 quando ha poucas chaves distintas.
+    '''
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def __call__(self, transacao):
+        cartao = str(transacao['numero_cartao'])
+        shards, _ = self.monitor.abertos()
+        inicio, fim, _ = shards[hash_key(cartao) % len(shards)]
+        return cartao, str((inicio + fim) // 2)
+
+
+def criar_partitioner(nome, monitor=None):
+    if nome == 'random':
+        return RandomPartitioner()
+    if nome == 'card':
+        return CardHashPartitioner()
+    if nome == 'explicit':
+        if monitor is None:
+            raise ValueError('O particionamento explicit precisa do ShardMonitor')
+        return ExplicitHashPartitioner(monitor)
+    raise ValueError(f"Partitioner desconhecido: {nome}")
@@ -0,0 +1,318 @@
+import queue
+import random
+import threading
+from time import monotonic, sleep
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from kpl import RecordAggregator
+
+
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+
+THROTTLE_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+    'KMSThrottlingException',
+)
+RETRYABLE_ERRORS = THROTTLE_ERRORS + (
+    'InternalFailure',
+    'ServiceUnavailable',
+)
+
+
+def entry_size(entry):
+    return len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
+
+
+def _records(batch):
+    return sum(records for _, records in batch)
+
+
+class AdaptiveController:
+    '''Controle AIMD do tamanho de lote e da taxa de envio.
+
+    Cada envio sem throttling aumenta o lote e a taxa de forma aditiva; um
+    envio com throttling reduz ambos pela metade, tomando a taxa observada
+    como referencia. Os reenvios usam backoff exponencial com full jitter.
+    '''
+
+    def __init__(
+        self,
+        max_records=MAX_RECORDS_PER_REQUEST,
+        min_records=10,
+        records_step=10,
+        min_rate=50,
+        rate_step=50,
+        base_backoff=0.1,
+        max_backoff=5,
+        max_retries=8
+    ):
+        self.max_records = max_records
+        self.min_records = min(min_records, max_records)
+        self.records_step = records_step
+        self.min_rate = min_rate
+        self.rate_step = rate_step
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.batch_limit = max_records
+        self.rate_limit = None
+        self.next_send = monotonic()
+        self.window_start = monotonic()
+        self.window_records = 0
+        self.observed_rate = 0.0
+
+    def _observe(self, records):
+        self.window_records += records
+        elapsed = monotonic() - self.window_start
+        if elapsed >= 1:
+            self.observed_rate = self.window_records / elapsed
+            self.window_start = monotonic()
+            self.window_records = 0
+
+    def pace(self, records):
+        if self.rate_limit is None:
+            return
+        now = monotonic()
+        if self.next_send > now:
+            sleep(self.next_send - now)
+        self.next_send = max(now, self.next_send) + records / self.rate_limit
+
+    def on_success(self, records):
+        self._observe(records)
+        self.batch_limit = min(self.max_records, self.batch_limit + self.records_step)
+        if self.rate_limit is not None:
+            self.rate_limit += self.rate_step
+
+    def on_throttle(self, records):
+        self._observe(records)
+        self.batch_limit = max(self.min_records, self.batch_limit // 2)
+        elapsed = max(monotonic() - self.window_start, 0.001)
+        reference = self.rate_limit or self.observed_rate or self.window_records / elapsed
+        self.rate_limit = max(self.min_rate, reference / 2)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+
+class KinesisProducer:
+    '''Acumula registros em uma fila limitada e os envia via PutRecords.
+
+    Um lote e enviado quando atinge max_records, max_bytes ou quando o
+    primeiro registro do lote espera mais que linger_ms. Com aggregate=True
+    os registros sao empacotados no formato KPL antes de entrar no lote;
+    com um ShardMonitor a agregacao e feita por shard de destino, preservando
+    a ordem por chave, e os contadores por shard sao atualizados.
+
+    Falhas parciais do PutRecords sao reenviadas apenas para as entradas que
+    falharam, com backoff; o AdaptiveController ajusta lote e taxa conforme o
+    throttling observado. stats['records'] conta as transacoes enviadas e
+    stats['entries'] as entradas do PutRecords (com agregacao, varias
+    transacoes por entrada). Entradas que esgotam as tentativas, ou cujo envio
+    falha com um erro nao recuperavel, sao descartadas e contadas em
+    stats['failed']. Se a thread de envio parar por um erro inesperado, put()
+    e close() relancam esse erro em vez de bloquear.
+    '''
+
+    def __init__(
+        self,
+        kinesis_client,
+        stream_name='card-stream',
+        max_records=MAX_RECORDS_PER_REQUEST,
+        max_bytes=MAX_BYTES_PER_REQUEST,
+        linger_ms=100,
+        queue_size=10000,
+        aggregate=False,
+        monitor=None,
+        controller=None
+    ):
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.max_records = min(max_records, MAX_RECORDS_PER_REQUEST)
+        self.max_bytes = min(max_bytes, MAX_BYTES_PER_REQUEST)
+        self.linger = linger_ms / 1000
+        self.aggregate = aggregate
+        self.aggregators = {}
+        self.monitor = monitor
+        self.controller = controller or AdaptiveController(self.max_records)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = threading.Event()
+        self.error = None
+        self.stats = {
+            'records': 0,
+            'entries': 0,
+            'requests': 0,
+            'bytes': 0,
+            'failed': 0,
+            'retries': 0,
+            'throttled': 0,
+            'queue': 0,
+        }
+        self.thread = threading.Thread(target=self._run, name='kinesis-producer', daemon=True)
+        self.thread.start()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('Thread de envio do producer interrompida') from self.error
+
+    def put(self, data, partition_key, explicit_hash_key=None):
+        if self.closed.is_set():
+            raise RuntimeError('Producer encerrado')
+        # bloqueia quando a fila esta cheia, aplicando backpressure no gerador,
+        # mas sem esperar para sempre por uma thread de envio que parou
+        while True:
+            self._check()
+            try:
+                self.queue.put((data, partition_key, explicit_hash_key), timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self._check()
+
+    def _entry(self, data, partition_key, explicit_hash_key):
+        entry = {'Data': data, 'PartitionKey': partition_key}
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        return entry
+
+    def _aggregator(self, partition_key, explicit_hash_key):
+        shard = None
+        if self.monitor is not None:
+            shard = self.monitor.shard_de(partition_key, explicit_hash_key)
+        if shard not in self.aggregators:
+            self.aggregators[shard] = RecordAggregator()
+        return self.aggregators[shard]
+
+    def _pending(self):
+        return any(len(aggregator) for aggregator in self.aggregators.values())
+
+    def _collect(self):
+        # o lote guarda (entrada, transacoes na entrada) para contar transacoes e nao entradas
+        batch = []
+        batch_bytes = 0
+        deadline = None
+
+        def append(entry, records=1):
+            nonlocal batch, batch_bytes
+            size = entry_size(entry)
+            if batch and batch_bytes + size > self.max_bytes:
+                self._send(batch)
+                batch, batch_bytes = [], 0
+            batch.append((entry, records))
+            batch_bytes += size
+
+        while len(batch) < self.controller.batch_limit:
+            timeout = 0.1 if deadline is None else deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                if deadline is None and self.closed.is_set():
+                    break
+                continue
+            if deadline is None:
+                deadline = monotonic() + self.linger
+
+            if not self.aggregate:
+                append(self._entry(*item))
+                continue
+            aggregator = self._aggregator(*item[1:])
+            if not aggregator.fits(*item):
+                append(*self._flush(aggregator))
+            aggregator.add(*item)
+
+        for aggregator in self.aggregators.values():
+            if len(batch) >= self.controller.batch_limit:
+                break
+            if len(aggregator):
+                append(*self._flush(aggregator))
+        return batch
+
+    def _flush(self, aggregator):
+        records = len(aggregator)
+        return aggregator.to_entry(), records
+
+    def _run(self):
+        try:
+            while not (self.closed.is_set() and self.queue.empty() and not self._pending()):
+                batch = self._collect()
+                if batch:
+                    self._send(batch)
+        except Exception as error:
+            print(f"Producer: thread de envio interrompida: {type(error).__name__}: {error}")
+            self.error = error
+
+    def metrics(self):
+        return {
+            **self.stats,
+            'queue': self.queue.qsize(),
+            'batch_limit': self.controller.batch_limit,
+            'rate_limit': self.controller.rate_limit,
+        }
+
+    def _put_records(self, batch):
+        entries = [entry for entry, _ in batch]
+        try:
+            response = self.kinesis_client.put_records(
+                StreamName=self.stream_name,
+                Records=entries
+            )
+        except ClientError as error:
+            code = error.response.get('Error', {}).get('Code')
+            if code not in RETRYABLE_ERRORS:
+                raise
+            return batch, len(batch) if code in THROTTLE_ERRORS else 0
+        except BotoCoreError as error:
+            print(f"PutRecords: erro de conexao {error}")
+            return batch, 0
+
+        if self.monitor is not None:
+            self.monitor.registrar(entries, response)
+        failed, throttled = [], 0
+        if response.get('FailedRecordCount', 0):
+            for pair, result in zip(batch, response['Records']):
+                if 'ErrorCode' in result:
+                    failed.append(pair)
+                    throttled += result['ErrorCode'] in THROTTLE_ERRORS
+        self.stats['requests'] += 1
+        self.stats['entries'] += len(batch) - len(failed)
+        self.stats['records'] += _records(batch) - _records(failed)
+        self.stats['bytes'] += sum(entry_size(entry) for entry, _ in batch) - sum(entry_size(entry) for entry, _ in failed)
+        return failed, throttled
+
+    def _send(self, batch):
+        pending = batch
+        attempt = 0
+        while pending:
+            self.controller.pace(len(pending))
+            try:
+                failed, throttled = self._put_records(pending)
+            except ClientError as error:
+                # AccessDenied, ResourceNotFound, ValidationException: reenviar nao resolve
+                self.stats['failed'] += _records(pending)
+                print(f"PutRecords: {_records(pending)} registros descartados: {error}")
+                break
+            if throttled:
+                self.stats['throttled'] += throttled
+                self.controller.on_throttle(len(pending) - len(failed))
+            else:
+                self.controller.on_success(len(pending) - len(failed))
+            if not failed:
+                break
+            attempt += 1
+            if attempt > self.controller.max_retries:
+                self.stats['failed'] += _records(failed)
+                print(f"PutRecords: {_records(failed)} registros descartados apos {attempt} tentativas")
+                break
+            # reenvia apenas as entradas que falharam
+            self.stats['retries'] += _records(failed)
+            sleep(self.controller.backoff(attempt))
+            pending = failed
+        self.stats['queue'] = self.queue.qsize()
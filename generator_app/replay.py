@@ -0,0 +1,107 @@
+import argparse
+import mmap
+import re
+import uuid
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+
+import boto3
+
+from producer import KinesisProducer
+
+# Os campos sao extraidos direto dos bytes da linha: o replay nao faz
+# json.loads nem passa pelo Faker ou pela geocodificacao.
+HORARIO = re.compile(rb'"horario_transacao":\s*"([^"]+)"')
+TRANSACAO = re.compile(rb'"transaction_id":\s*"([^"]+)"')
+CARTAO = re.compile(rb'"numero_cartao":\s*"?([^",}]+)')
+
+
+def linhas(mm):
+    inicio = 0
+    while inicio < len(mm):
+        fim = mm.find(b'\n', inicio)
+        if fim == -1:
+            fim = len(mm)
+        if fim > inicio:
+            yield mm[inicio:fim]
+        inicio = fim + 1
+
+
+def parse_velocidade(valor):
+    return None if valor == 'max' else float(valor)
+
+
+def chave(linha, partitioner):
+    if partitioner is not None:
+        cartao = CARTAO.search(linha)
+        if cartao:
+            # os partitioners so olham o numero do cartao
+            return partitioner({'numero_cartao': cartao.group(1).decode('utf-8')})
+    transacao = TRANSACAO.search(linha)
+    return (transacao.group(1).decode('ascii') if transacao else str(uuid.uuid4())), None
+
+
+def replay(arquivo, producer, velocidade=None, rebase=False, parar=None, intervalo=10, partitioner=None):
+    '''Republica um arquivo JSONL gravado pelo gerador.
+
+    velocidade=None envia o mais rapido possivel; caso contrario respeita o
+    intervalo entre os horario_transacao dividido pela velocidade. Com
+    rebase=True os horarios sao deslocados para o inicio do replay (e
+    comprimidos pela velocidade), mantendo os watermarks do Flink coerentes.
+    Com um partitioner a chave vem do numero_cartao da linha; sem ele, do
+    transaction_id.
+    '''
+    enviados = 0
+    primeiro = None
+    inicio = ultimo_relatorio = monotonic()
+    inicio_relogio = datetime.now()
+    with open(arquivo, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for linha in linhas(mm):
+            if parar is not None and parar.is_set():
+                break
+
+            if velocidade is not None or rebase:
+                horario = HORARIO.search(linha)
+                original = datetime.fromisoformat(horario.group(1).decode('ascii'))
+                if primeiro is None:
+                    primeiro = original
+                decorrido = (original - primeiro).total_seconds() / (velocidade or 1)
+                if velocidade is not None:
+                    espera = inicio + decorrido - monotonic()
+                    if espera > 0:
+                        sleep(espera)
+                if rebase:
+                    novo = inicio_relogio + timedelta(seconds=decorrido)
+                    linha = linha[:horario.start(1)] + novo.isoformat().encode('ascii') + linha[horario.end(1):]
+
+            producer.put(bytes(linha), *chave(linha, partitioner))
+            enviados += 1
+
+            if monotonic() - ultimo_relatorio >= intervalo:
+                print(f"Replay: {enviados} registros ({enviados / (monotonic() - inicio):.0f} registros/s)")
+                ultimo_relatorio = monotonic()
+
+    duracao = monotonic() - inicio
+    print(f"Replay: concluido com {enviados} registros em {duracao:.1f}s")
+    return enviados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Republica no card-stream um arquivo JSONL gravado pelo gerador')
+    parser.add_argument('arquivo')
+    parser.add_argument('--velocidade', default='max', help='1 para tempo real, N para N vezes mais rapido ou max')
+    parser.add_argument('--rebase', action='store_true', help='desloca horario_transacao para o inicio do replay')
+    parser.add_argument('--stream', default='card-stream')
+    parser.add_argument('--agregar', action='store_true', help='agrega os registros no formato KPL')
+    args = parser.parse_args()
+
+    producer = KinesisProducer(boto3.client('kinesis'), stream_name=args.stream, aggregate=args.agregar)
+    try:
+        replay(args.arquivo, producer, parse_velocidade(args.velocidade), args.rebase)
+    finally:
+        producer.close()
+    print(producer.stats)
+
+
+if __name__ == "__main__":
+    main()
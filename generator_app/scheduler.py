@@ -0,0 +1,166 @@
+import asyncio
+import json
+import math
+import os
+from datetime import datetime
+from time import monotonic
+
+# Perfis de carga: cada um devolve a taxa alvo (registros/s) no instante t,
+# em segundos desde o inicio do agendador.
+
+
+def constant(tps):
+    return lambda t: tps
+
+
+def ramp(de, ate, duracao):
+    return lambda t: de + (ate - de) * min(t / duracao, 1)
+
+
+def step(degraus, repetir=False):
+    total = sum(degrau['duracao'] for degrau in degraus)
+
+    def taxa(t):
+        if repetir:
+            t %= total
+        for degrau in degraus:
+            if t < degrau['duracao']:
+                return degrau['tps']
+            t -= degrau['duracao']
+        return degraus[-1]['tps']
+    return taxa
+
+
+def burst(tps, pico, periodo, duracao):
+    return lambda t: pico if t % periodo < duracao else tps
+
+
+def diurnal(minimo, maximo, hora_pico=14, periodo=86400):
+    # curva cossenoidal com pico em hora_pico; periodo < 86400 comprime o dia
+    inicio = datetime.now()
+    hora_inicial = inicio.hour + inicio.minute / 60 + inicio.second / 3600
+
+    def taxa(t):
+        hora = (hora_inicial + t * 24 / periodo) % 24
+        fase = math.cos(2 * math.pi * (hora - hora_pico) / 24)
+        return minimo + (maximo - minimo) * (1 + fase) / 2
+    return taxa
+
+
+PERFIS = {
+    'constant': constant,
+    'ramp': ramp,
+    'step': step,
+    'burst': burst,
+    'diurnal': diurnal,
+}
+
+
+def criar_perfil(config, escala=1):
+    '''Cria o perfil a partir de {"tipo": ..., parametros}; escala divide a carga entre workers.'''
+    config = dict(config)
+    tipo = config.pop('tipo', 'constant')
+    if tipo not in PERFIS:
+        raise ValueError(f"Perfil de carga desconhecido: {tipo}")
+    taxa = PERFIS[tipo](**config)
+    return lambda t: max(taxa(t), 0) * escala
+
+
+def carregar_config(environ=os.environ):
+    '''Le o perfil de LOAD_PROFILE_FILE, LOAD_PROFILE (JSON) ou TARGET_TPS, nessa ordem.'''
+    arquivo = environ.get('LOAD_PROFILE_FILE')
+    if arquivo:
+        with open(arquivo) as f:
+            return json.load(f)
+    if environ.get('LOAD_PROFILE'):
+        return json.loads(environ['LOAD_PROFILE'])
+    if environ.get('TARGET_TPS'):
+        return {'tipo': 'constant', 'tps': float(environ['TARGET_TPS'])}
+    return None
+
+
+class Scheduler:
+    '''Agendador open-loop com token bucket.
+
+    A cada tick os tokens acumulam pela taxa do perfil e enviar(n) recebe a
+    parte inteira. Os ticks sao agendados em tempo absoluto, entao o tempo
+    gasto em enviar() nao acumula deriva; o atraso e compensado no tick
+    seguinte ate o limite de rajada, e o excedente e contado como perdido.
+    '''
+
+    def __init__(self, perfil, enviar, tick=0.01, rajada=1.0, intervalo=10, arquivo=None, escala=1, parar=None):
+        self.perfil = perfil
+        self.enviar = enviar
+        self.tick = tick
+        self.rajada = rajada
+        self.intervalo = intervalo
+        self.arquivo = arquivo
+        self.escala = escala
+        self.parar = parar or asyncio.Event()
+        self.stats = {'enviados': 0, 'perdidos': 0, 'esperados': 0.0}
+
+    def stop(self):
+        self.parar.set()
+
+    def _recarregar(self, mtime):
+        # permite ajustar a carga em execucao editando o arquivo do perfil
+        try:
+            atual = os.stat(self.arquivo).st_mtime
+        except OSError:
+            return mtime
+        if atual != mtime:
+            if mtime is not None:
+                with open(self.arquivo) as f:
+                    self.perfil = criar_perfil(json.load(f), self.escala)
+                print(f"Scheduler: perfil recarregado de {self.arquivo}")
+            return atual
+        return mtime
+
+    async def run(self, duracao=None):
+        loop = asyncio.get_running_loop()
+        inicio = loop.time()
+        anterior = inicio
+        tokens = 0.0
+        tick = 0
+        mtime = self._recarregar(None) if self.arquivo else None
+        ultimo_relatorio, enviados_relatorio = monotonic(), 0
+
+        while not self.parar.is_set():
+            agora = loop.time()
+            t = agora - inicio
+            if duracao is not None and t >= duracao:
+                break
+
+            taxa = self.perfil(t)
+            tokens += taxa * (agora - anterior)
+            self.stats['esperados'] += taxa * (agora - anterior)
+            anterior = agora
+            capacidade = max(taxa * self.rajada, 1)
+            if tokens > capacidade:
+                self.stats['perdidos'] += int(tokens - capacidade)
+                tokens = capacidade
+
+            n = int(tokens)
+            if n:
+                tokens -= n
+                self.enviar(n)
+                self.stats['enviados'] += n
+
+            if monotonic() - ultimo_relatorio >= self.intervalo:
+                decorrido = monotonic() - ultimo_relatorio
+                real = (self.stats['enviados'] - enviados_relatorio) / decorrido
+                print(f"Scheduler: alvo={taxa:.0f}/s real={real:.0f}/s perdidos={self.stats['perdidos']}")
+                ultimo_relatorio, enviados_relatorio = monotonic(), self.stats['enviados']
+                if self.arquivo:
+                    mtime = self._recarregar(mtime)
+
+            # proximo tick em tempo absoluto para corrigir a deriva
+            tick += 1
+            proximo = inicio + tick * self.tick
+            atraso = proximo - loop.time()
+            if atraso > 0:
+                await asyncio.sleep(atraso)
+            else:
+                tick = math.ceil((loop.time() - inicio) / self.tick)
+                await asyncio.sleep(0)
+        return self.stats
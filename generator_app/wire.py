@@ -0,0 +1 @@
+../lambda_app/shared/python/wire.py
\ No newline at end of file
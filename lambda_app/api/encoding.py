@@ -0,0 +1,118 @@
+import base64
+import json
+import zlib
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary, TypeDeserializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Conversao das respostas do DynamoDB para JSON simples e compressao do corpo
+# conforme o Accept-Encoding do cliente.
+
+deserializer = TypeDeserializer()
+BUFFER_BYTES = 64 * 1024
+
+
+class DecimalEncoder(json.JSONEncoder):
+    '''Numeros do DynamoDB chegam como Decimal: inteiros viram int, o resto float.'''
+
+    def default(self, value):
+        if isinstance(value, Decimal):
+            return int(value) if value == value.to_integral_value() else float(value)
+        if isinstance(value, (set, frozenset)):
+            return sorted(value, key=str)
+        if isinstance(value, Binary):
+            return base64.b64encode(value.value).decode('ascii')
+        return super().default(value)
+
+
+compact = DecimalEncoder(separators=(',', ':'))
+
+
+def is_key(key):
+    '''Chave de tabela ou indice vinda do cliente: atributos tipados S, N ou B.'''
+    return isinstance(key, dict) and bool(key) and all(
+        isinstance(value, dict) and len(value) == 1 and next(iter(value)) in ('S', 'N', 'B')
+        and isinstance(next(iter(value.values())), str)
+        for value in key.values()
+    )
+
+
+def plain(item):
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+def dumps(value):
+    return compact.encode(value)
+
+
+def negotiate(headers):
+    '''Escolhe br ou gzip pelo Accept-Encoding, respeitando os pesos q.'''
+    accepted = {}
+    for name, value in (headers or {}).items():
+        if name.lower() != 'accept-encoding':
+            continue
+        for part in value.split(','):
+            coding, _, params = part.strip().partition(';')
+            weight = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    weight = float(params[2:])
+                except ValueError:
+                    weight = 0.0
+            accepted[coding.strip().lower()] = weight
+    options = [coding for coding in ('br', 'gzip') if coding != 'br' or brotli is not None]
+    options = [coding for coding in options if accepted.get(coding, accepted.get('*', 0)) > 0]
+    if not options:
+        return None
+    return max(options, key=lambda coding: accepted.get(coding, accepted.get('*', 0)))
+
+
+def _compressor(encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def encode(chunks, encoding, minimum):
+    '''Serializa os pedacos em sequencia, comprimindo em blocos.
+
+    Enquanto o corpo nao atinge o tamanho minimo ele fica em memoria e volta
+    sem compressao; a partir dai cada bloco segue direto para o compressor.
+    Devolve (bytes, encoding usado).
+    '''
+    pending = []
+    size = 0
+    out = []
+    compress = finish = None
+    for chunk in chunks:
+        data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+        pending.append(data)
+        size += len(data)
+        if encoding is None:
+            continue
+        if compress is None:
+            if size < minimum:
+                continue
+            compress, finish = _compressor(encoding)
+        if size >= BUFFER_BYTES:
+            out.append(compress(b''.join(pending)))
+            pending = []
+            size = 0
+    if compress is None:
+        return b''.join(pending), None
+    if pending:
+        out.append(compress(b''.join(pending)))
+    out.append(finish())
+    return b''.join(out), encoding
+
+
+def stream(value):
+    return compact.iterencode(value)
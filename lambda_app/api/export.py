@@ -0,0 +1,157 @@
+import base64
+import gzip
+import io
+import json
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from encoding import dumps, is_key, plain
+
+# Exportacao da tabela com scan paralelo (Segment/TotalSegments). Cada chamada
+# avanca os segmentos ate o prazo e devolve um checkpoint com a ultima chave
+# lida de cada segmento; a proxima chamada continua dali.
+#
+# Com bucket, cada segmento grava partes NDJSON em GZIP:
+#   <prefixo>/<export_id>/segment=<nnn>/part-<nnnnn>.ndjson.gz
+# e o checkpoint tambem e salvo em <prefixo>/<export_id>/checkpoint.json.
+# Sem bucket, as linhas voltam no corpo da resposta em blocos limitados.
+
+EXPORT_ID = re.compile(r'[0-9a-f]{32}')
+
+
+def ndjson(items):
+    return b''.join(dumps(plain(item)).encode('utf-8') + b'\n' for item in items)
+
+
+def new_state(total_segments):
+    return {
+        'ExportId': uuid.uuid4().hex,
+        'TotalSegments': total_segments,
+        'Segments': [{'Parte': 0, 'Done': False} for _ in range(total_segments)]
+    }
+
+
+def encode_checkpoint(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_checkpoint(token):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except ValueError:
+        raise ValueError('Checkpoint invalido')
+    # o checkpoint vem do cliente: ExportId entra na chave do S3 e os
+    # segmentos sao usados direto no Scan
+    if not (
+        isinstance(state, dict)
+        and isinstance(state.get('ExportId'), str) and EXPORT_ID.fullmatch(state['ExportId'])
+        and type(state.get('TotalSegments')) is int
+        and isinstance(state.get('Segments'), list) and len(state['Segments']) == state['TotalSegments']
+        and all(valid_segment(segment) for segment in state['Segments'])
+    ):
+        raise ValueError('Checkpoint invalido')
+    return state
+
+
+def valid_segment(segment):
+    return (
+        isinstance(segment, dict)
+        and type(segment.get('Done')) is bool
+        and type(segment.get('Parte')) is int and segment['Parte'] >= 0
+        and ('ExclusiveStartKey' not in segment or is_key(segment['ExclusiveStartKey']))
+    )
+
+
+class Exporter:
+
+    def __init__(self, dynamo, table, deadline, s3=None, bucket=None, prefix='exportacao',
+                 page_size=500, part_bytes=8 * 1024 * 1024, max_bytes=2 * 1024 * 1024):
+        self.dynamo = dynamo
+        self.table = table
+        self.deadline = deadline
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.page_size = page_size
+        self.part_bytes = part_bytes
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def load(self, export_id):
+        response = self.s3.get_object(Bucket=self.bucket, Key='{}/{}/checkpoint.json'.format(self.prefix, export_id))
+        return json.loads(response['Body'].read())
+
+    def run(self, state):
+        '''Avanca todos os segmentos em paralelo; devolve (registros, arquivos, linhas).'''
+        # uma thread por segmento: cada _segment roda ate o prazo, entao um pool
+        # menor deixaria os segmentos excedentes parados ate o fim da chamada
+        with ThreadPoolExecutor(max_workers=state['TotalSegments']) as pool:
+            results = list(pool.map(lambda segment: self._segment(state, segment), range(state['TotalSegments'])))
+        records = sum(result[0] for result in results)
+        files = [name for result in results for name in result[1]]
+        if self.s3 is not None:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key='{}/{}/checkpoint.json'.format(self.prefix, state['ExportId']),
+                Body=json.dumps(state).encode('utf-8')
+            )
+        return records, files, b''.join(result[2] for result in results)
+
+    def _full(self):
+        # no modo em blocos o corpo da resposta e limitado; com S3 so o prazo conta
+        return self.s3 is None and self.size >= self.max_bytes
+
+    def _flush(self, state, segment, buffer, files):
+        current = state['Segments'][segment]
+        key = '{}/{}/segment={:03d}/part-{:05d}.ndjson.gz'.format(
+            self.prefix, state['ExportId'], segment, current['Parte']
+        )
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=buffer.getvalue(), ContentEncoding='gzip')
+        current['Parte'] += 1
+        files.append(key)
+
+    def _segment(self, state, segment):
+        current = state['Segments'][segment]
+        records = 0
+        files = []
+        chunk = []
+        buffer = gz = None
+        while not current['Done'] and monotonic() < self.deadline and not self._full():
+            kwargs = {
+                'TableName': self.table,
+                'Segment': segment,
+                'TotalSegments': state['TotalSegments'],
+                'Limit': self.page_size
+            }
+            if 'ExclusiveStartKey' in current:
+                kwargs['ExclusiveStartKey'] = current['ExclusiveStartKey']
+            response = self.dynamo.scan(**kwargs)
+            data = ndjson(response['Items'])
+            records += response['Count']
+            if self.s3 is None:
+                chunk.append(data)
+                with self.lock:
+                    self.size += len(data)
+            else:
+                if gz is None:
+                    buffer = io.BytesIO()
+                    gz = gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0)
+                gz.write(data)
+            if 'LastEvaluatedKey' in response:
+                current['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            else:
+                current.pop('ExclusiveStartKey', None)
+                current['Done'] = True
+            if gz is not None and (buffer.tell() >= self.part_bytes or current['Done']):
+                gz.close()
+                self._flush(state, segment, buffer, files)
+                buffer = gz = None
+        if gz is not None:
+            # o checkpoint so avanca junto com as partes ja gravadas
+            gz.close()
+            self._flush(state, segment, buffer, files)
+        return records, files, b''.join(chunk)
@@ -1,50 +1,402 @@
+import base64
 import boto3
 import json
+import re
+import threading
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import environ
+from time import monotonic
 
-dynamo = boto3.client('dynamodb')
+from encoding import dumps, encode, is_key, negotiate, plain, stream
+from export import Exporter, decode_checkpoint, encode_checkpoint, new_state
 
+TABLE = environ.get('TABLE')
+SUMMARY_TABLE = environ.get('SUMMARY_TABLE')
+TIME_INDEX = environ.get('TIME_INDEX', 'horario-index')
+DEFAULT_PAGE_SIZE = int(environ.get('DEFAULT_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(environ.get('MAX_PAGE_SIZE', '500'))
+CACHE_SIZE = int(environ.get('CACHE_SIZE', '1000'))
+CACHE_TTL = float(environ.get('CACHE_TTL', '5'))
+BATCH_WORKERS = int(environ.get('BATCH_WORKERS', '16'))
+MAX_BATCH_CARDS = int(environ.get('MAX_BATCH_CARDS', '200'))
+# margem abaixo do limite de 6 MB da resposta do Lambda
+MAX_RESPONSE_BYTES = int(environ.get('MAX_RESPONSE_BYTES', str(5 * 1024 * 1024)))
+EXPORT_BUCKET = environ.get('EXPORT_BUCKET')
+EXPORT_SEGMENTS = int(environ.get('EXPORT_SEGMENTS', '8'))
+MAX_EXPORT_SEGMENTS = int(environ.get('MAX_EXPORT_SEGMENTS', '64'))
+# sem bucket o checkpoint (uma chave por segmento) volta em um cabecalho, que o
+# API Gateway limita a 10 KB somados
+MAX_CHUNK_SEGMENTS = int(environ.get('MAX_CHUNK_SEGMENTS', '16'))
+# abaixo do limite de 29 s do API Gateway
+EXPORT_TIME_BUDGET = float(environ.get('EXPORT_TIME_BUDGET', '20'))
+EXPORT_CHUNK_BYTES = int(environ.get('EXPORT_CHUNK_BYTES', str(2 * 1024 * 1024)))
+MIN_COMPRESS_BYTES = int(environ.get('MIN_COMPRESS_BYTES', '1024'))
+FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
 
-def respond(err, res=None):
+dynamo = boto3.client('dynamodb', config=Config(max_pool_connections=max(BATCH_WORKERS, MAX_EXPORT_SEGMENTS)))
+executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+s3 = boto3.client('s3') if EXPORT_BUCKET else None
+
+
+class TTLCache:
+    '''LRU em que cada entrada expira ttl segundos depois de gravada.'''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # consultas em lote acessam o cache a partir de varias threads
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+
+def respond(err, res=None, headers=None):
+    # o corpo e serializado (e comprimido) em finish, no fim do handler
     return {
         'statusCode': '400' if err else '200',
-        'body': err.message if err else json.dumps(res),
+        'body': str(err) if err else res,
         'headers': {
             'Content-Type': 'application/json',
+            **(headers or {}),
         },
     }
 
 
+def finish(response, encoding):
+    body = response['body']
+    data, used = encode([body] if isinstance(body, (str, bytes)) else stream(body), encoding, MIN_COMPRESS_BYTES)
+    response['headers']['Vary'] = 'Accept-Encoding'
+    if used is None:
+        response['body'] = data.decode('utf-8')
+        return response
+    response['headers']['Content-Encoding'] = used
+    response['body'] = base64.b64encode(data).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def unwrap(response):
+    '''Resposta do DynamoDB em JSON simples, sem ResponseMetadata.'''
+    result = {}
+    if 'Item' in response:
+        result['Item'] = plain(response['Item'])
+    if 'Attributes' in response:
+        result['Attributes'] = plain(response['Attributes'])
+    return result
+
+
+def cached(key, fetch, log=True):
+    '''Consulta por cartao com read-through no cache do container.'''
+    result = cache.get(key)
+    status = 'HIT'
+    if result is None:
+        status = 'MISS'
+        result = fetch()
+        cache.put(key, result)
+    if log:
+        print('Cache {}: {} hits, {} misses, {} entradas'.format(status, cache.hits, cache.misses, len(cache.entries)))
+    return result, {'X-Cache': status}
+
+
+def encode_token(last_evaluated_key):
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('ascii')
+
+
+def decode_token(token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except ValueError:
+        raise ValueError('NextToken invalido')
+    if not is_key(key):
+        raise ValueError('NextToken invalido')
+    return key
+
+
+def page_options(params):
+    '''Traduz Limit, NextToken e Fields da query string para o Query/Scan.'''
+    try:
+        limit = int(params.get('Limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Limit deve ser um inteiro')
+    if limit < 1:
+        raise ValueError('Limit deve ser maior que zero')
+    options = {'Limit': min(limit, MAX_PAGE_SIZE)}
+    if params.get('NextToken'):
+        options['ExclusiveStartKey'] = decode_token(params['NextToken'])
+    if params.get('Fields'):
+        fields = [field.strip() for field in params['Fields'].split(',') if field.strip()]
+        for field in fields:
+            if not FIELD.match(field):
+                raise ValueError('Campo invalido: {}'.format(field))
+        # nomes substitutos evitam conflito com palavras reservadas (ex.: TTL)
+        options['ProjectionExpression'] = ', '.join('#f{}'.format(i) for i in range(len(fields)))
+        options['ExpressionAttributeNames'] = {'#f{}'.format(i): field for i, field in enumerate(fields)}
+    return options
+
+
+def card_query(params):
+    '''Query por cartao; com from/to le a faixa de horario no indice, do mais recente ao mais antigo.'''
+    query = {
+        'KeyConditionExpression': 'numero_cartao = :numero_cartao',
+        'ExpressionAttributeValues': {':numero_cartao': {'S': params['Key']}}
+    }
+    if params.get('Tipo'):
+        # com mode=both o Flink grava linhas por janela e por transacao do mesmo cartao
+        if params['Tipo'] not in ('janela', 'velocidade'):
+            raise ValueError('Tipo deve ser janela ou velocidade')
+        query['FilterExpression'] = 'Tipo = :tipo'
+        query['ExpressionAttributeValues'][':tipo'] = {'S': params['Tipo']}
+    bounds = {name: params[name] for name in ('from', 'to') if params.get(name)}
+    if not bounds:
+        return query
+    for name, value in bounds.items():
+        try:
+            datetime.fromisoformat(value.replace('Z', ''))
+        except ValueError:
+            raise ValueError('{} deve ser um horario ISO-8601'.format(name))
+        query['ExpressionAttributeValues'][':' + name] = {'S': value}
+    if len(bounds) == 2:
+        condition = 'horario_transacao BETWEEN :from AND :to'
+    elif 'from' in bounds:
+        condition = 'horario_transacao >= :from'
+    else:
+        condition = 'horario_transacao <= :to'
+    query['KeyConditionExpression'] += ' AND ' + condition
+    query['IndexName'] = TIME_INDEX
+    query['ScanIndexForward'] = False
+    return query
+
+
+def page(response):
+    result = {'Items': [plain(item) for item in response['Items']], 'Count': response['Count']}
+    if 'LastEvaluatedKey' in response:
+        result['NextToken'] = encode_token(response['LastEvaluatedKey'])
+    return result
+
+
+def batch_summaries(cards):
+    # BatchGetItem aceita ate 100 chaves; chaves nao processadas sao reenviadas
+    result = {}
+    for i in range(0, len(cards), 100):
+        request = {SUMMARY_TABLE: {'Keys': [{'numero_cartao': {'S': card}} for card in cards[i:i + 100]]}}
+        while request:
+            response = dynamo.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(SUMMARY_TABLE, []):
+                result[item['numero_cartao']['S']] = item
+            request = response.get('UnprocessedKeys')
+    return {card: {'Item': plain(result[card])} if card in result else {} for card in cards}
+
+
+def batch_lookup(body):
+    '''Consulta varios cartoes de uma vez, em paralelo, limitando o tamanho da resposta.'''
+    if not isinstance(body, dict):
+        raise ValueError('Corpo deve ser um objeto JSON')
+    cards = body.get('Cards')
+    if not isinstance(cards, list) or not all(isinstance(card, str) for card in cards):
+        raise ValueError('Cards deve ser uma lista de numeros de cartao')
+    cards = list(dict.fromkeys(cards))
+    if len(cards) > MAX_BATCH_CARDS:
+        raise ValueError('No maximo {} cartoes por consulta'.format(MAX_BATCH_CARDS))
+    params = {name: str(value) for name, value in body.items() if name in ('Limit', 'Fields', 'from', 'to', 'Tipo')}
+
+    if body.get('Resumo'):
+        results = batch_summaries(cards)
+    else:
+        table = TABLE
+        queries = {}
+        for card in cards:
+            options = page_options(params)
+            options.update(card_query(dict(params, Key=card)))
+            queries[card] = options
+
+        def fetch(card):
+            key = ('query', table, json.dumps(queries[card], sort_keys=True))
+            return cached(key, lambda: page(dynamo.query(TableName=table, **queries[card])), log=False)[0]
+
+        results = dict(zip(cards, executor.map(fetch, cards)))
+
+    # cartoes que nao cabem na resposta voltam em Pendentes para uma nova chamada
+    merged = {'Cards': {}, 'Pendentes': []}
+    size = 0
+    for card in cards:
+        size += len(dumps(results[card])) + len(card) + 8
+        if size > MAX_RESPONSE_BYTES:
+            merged['Pendentes'].append(card)
+        else:
+            merged['Cards'][card] = results[card]
+    print('Consulta em lote: {} cartoes, {} pendentes, cache {} hits, {} misses'.format(
+        len(cards), len(merged['Pendentes']), cache.hits, cache.misses))
+    return merged
+
+
+def export(params, context):
+    '''Avanca uma exportacao por scan paralelo ate o prazo da chamada.'''
+    budget = EXPORT_TIME_BUDGET
+    if context is not None:
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000 - 2)
+    exporter = Exporter(
+        dynamo, params.get('TableName', TABLE), monotonic() + budget,
+        s3=s3, bucket=EXPORT_BUCKET, max_bytes=EXPORT_CHUNK_BYTES
+    )
+    limit = MAX_EXPORT_SEGMENTS if s3 is not None else min(MAX_EXPORT_SEGMENTS, MAX_CHUNK_SEGMENTS)
+    if params.get('Checkpoint'):
+        state = decode_checkpoint(params['Checkpoint'])
+    elif params.get('ExportId') and s3 is not None:
+        state = exporter.load(params['ExportId'])
+    else:
+        try:
+            state = new_state(int(params.get('Segments', min(EXPORT_SEGMENTS, limit))))
+        except ValueError:
+            raise ValueError('Segments deve ser um inteiro')
+    if not 1 <= state['TotalSegments'] <= limit:
+        raise ValueError('Segments deve estar entre 1 e {}'.format(limit))
+
+    start = monotonic()
+    records, files, lines = exporter.run(state)
+    done = all(segment['Done'] for segment in state['Segments'])
+    print('Exportacao {}: {} registros de {} segmentos em {:.1f} s, concluida={}'.format(
+        state['ExportId'], records, state['TotalSegments'], monotonic() - start, done))
+    checkpoint = encode_checkpoint(state)
+    if s3 is not None:
+        return respond(None, {
+            'ExportId': state['ExportId'],
+            'Done': done,
+            'Registros': records,
+            'Arquivos': files,
+            'Checkpoint': checkpoint
+        })
+    # sem bucket, o bloco NDJSON vai no corpo e o checkpoint nos cabecalhos
+    return {
+        'statusCode': '200',
+        'body': lines,
+        'headers': {
+            'Content-Type': 'application/x-ndjson',
+            'X-Export-Id': state['ExportId'],
+            'X-Export-Done': 'true' if done else 'false',
+            'X-Export-Checkpoint': checkpoint,
+        },
+    }
+
+
+def validated(call):
+    '''Erros de validacao, nossos ou do DynamoDB, vem da requisicao: viram 400.'''
+    try:
+        return call()
+    except ValueError as err:
+        return respond(err)
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ValidationException':
+            raise
+        return respond(ValueError(error.response['Error']['Message']))
+
+
+def lookup(params):
+    if params.get('Resumo') == 'true':
+        if not params.get('Key'):
+            raise ValueError('Key e obrigatorio com Resumo=true')
+        result, headers = cached(('resumo', params['Key']), lambda: unwrap(dynamo.get_item(
+            TableName=SUMMARY_TABLE,
+            Key={'numero_cartao': {'S': params['Key']}}
+        )))
+        return respond(None, result, headers)
+    options = page_options(params)
+    table = params.get('TableName', TABLE)
+    if 'Key' in params:
+        options.update(card_query(params))
+        # a chave inclui o formato da consulta: faixa, pagina, campos e token
+        key = ('query', table, json.dumps(options, sort_keys=True))
+        result, headers = cached(key, lambda: page(dynamo.query(TableName=table, **options)))
+        return respond(None, result, headers)
+    return respond(None, page(dynamo.scan(TableName=table, **options)))
+
+
 def handler(event, context):
     '''Demonstrates a simple HTTP endpoint using API Gateway. You have full
     access to the request and response payload, including headers and
     status code.
 
-    To scan a DynamoDB table, make a GET request with the TableName as a
-    query string parameter. To put, update, or delete an item, make a POST,
+    A GET request returns one page of the transactions table, or of a card
+    when Key is given. Limit sets the page size (capped at MAX_PAGE_SIZE),
+    Fields selects a comma separated list of attributes and NextToken,
+    returned with every page that is not the last, fetches the next page.
+    With Key, from and/or to (ISO-8601) restrict the card's transactions to
+    a time range, newest first, and Tipo (janela or velocidade) keeps only
+    one kind of Flink row.
+    To put, update, or delete an item, make a POST,
     PUT, or DELETE request respectively, passing in the payload to the
     DynamoDB API as a JSON body.
+
+    To get the summary of a card (count, total, max, first and last
+    transaction), make a GET request with Key and Resumo=true. With
+    mode=window it covers the transactions of the card's alerted tumbling
+    windows; hopping windows only count in alertas_janela.
+
+    A POST to /batch with {"Cards": [...]} looks up many cards concurrently,
+    accepting the same Limit, Fields, from, to, Tipo and Resumo options. Cards that
+    do not fit in the response are returned in Pendentes.
+
+    A GET to /export runs a parallel scan (Segments, default
+    EXPORT_SEGMENTS, at most MAX_CHUNK_SEGMENTS without a bucket) until
+    the call's time budget. With EXPORT_BUCKET the
+    rows go to gzipped NDJSON parts in S3; otherwise a chunk of NDJSON is
+    returned in the body. Pass the returned Checkpoint (or ExportId, with a
+    bucket) to continue until Done.
+
+    Items are returned as plain JSON, compressed with br or gzip when the
+    client sends Accept-Encoding.
     '''
     #print("Received event: " + json.dumps(event, indent=2))
+    return finish(route(event, context), negotiate(event.get('headers')))
+
 
+def route(event, context):
     operations = {
         'DELETE': lambda dynamo, x: dynamo.delete_item(**x),
-        'GET': lambda dynamo, x: dynamo.scan(**x),
         'POST': lambda dynamo, x: dynamo.put_item(**x),
         'PUT': lambda dynamo, x: dynamo.update_item(**x),
     }
 
     operation = event['httpMethod']
+    path = (event.get('path') or '').rstrip('/')
+    params = event.get('queryStringParameters') or {}
+    if operation == 'GET' and path.endswith('/export'):
+        return validated(lambda: export(params, context))
+    if operation == 'GET':
+        return validated(lambda: lookup(params))
+    body = event.get('body') or '{}'
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    if operation == 'POST' and path.endswith('/batch'):
+        return validated(lambda: respond(None, batch_lookup(json.loads(body))))
     if operation in operations:
-        if operation == 'GET' and 'Key' in event['queryStringParameters']:
-            result = dynamo.query(
-                TableName=event['queryStringParameters']['TableName'],
-                KeyConditionExpression='numero_cartao = :numero_cartao',
-                ExpressionAttributeValues={
-                    ':numero_cartao': {'S': event['queryStringParameters']['Key']}
-                }
-            )
-            return respond(None, result)
-        payload = event['queryStringParameters'] if operation == 'GET' else json.loads(event['body'])
-        return respond(None, operations[operation](dynamo, payload))
+        return respond(None, unwrap(operations[operation](dynamo, json.loads(body))))
     else:
-        return respond(ValueError('Unsupported method "{}"'.format(operation)))
\ No newline at end of file
+        return respond(ValueError('Unsupported method "{}"'.format(operation)))
@@ -1,25 +1,347 @@
 import base64
 import boto3
-from time import time
+import random
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from time import time, sleep, perf_counter
 from os import environ
-import json
+from kpl import deaggregate
+from wire import decode
 
-ddb_client = boto3.client('dynamodb')
 TABLE = environ.get('TABLE')
+SUMMARY_TABLE = environ.get('SUMMARY_TABLE')
+MAX_WORKERS = int(environ.get('MAX_WORKERS', '8'))
+MAX_RETRIES = int(environ.get('MAX_RETRIES', '8'))
+DEDUP_CACHE_SIZE = int(environ.get('DEDUP_CACHE_SIZE', '100000'))
+# o ADD do resumo nao e idempotente: com a tabela de resumo so entram no resumo
+# itens confirmados como novos pela escrita condicional, para que um registro
+# reentregue pelo Lambda (retomada a partir da menor falha) nao seja somado de
+# novo. Se o resumo falhar depois da escrita, o retry encontra o item ja gravado
+# e o resumo fica sem ele: a contagem pode ficar abaixo, nunca acima.
+# O PutItem condicional nao tem versao em lote: cada item e uma chamada,
+# distribuida entre os MAX_WORKERS do executor. E o caminho usado no deploy
+# (realtime.py define CONDITIONAL_WRITE=true junto com SUMMARY_TABLE).
+CONDITIONAL_WRITE = environ.get('CONDITIONAL_WRITE', 'true' if SUMMARY_TABLE else 'false').lower() == 'true'
+BATCH_SIZE = 25
+
+ddb_client = boto3.client('dynamodb', config=Config(max_pool_connections=MAX_WORKERS))
+# reaproveitado entre invocacoes do mesmo container
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+class SeenCache:
+    '''LRU das chaves ja gravadas, mantido entre invocacoes do mesmo container.'''
+
+    def __init__(self, size):
+        self.size = size
+        self.keys = OrderedDict()
+
+    def __contains__(self, key):
+        if key not in self.keys:
+            return False
+        self.keys.move_to_end(key)
+        return True
+
+    def add(self, key):
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        if len(self.keys) > self.size:
+            self.keys.popitem(last=False)
+
+
+seen = SeenCache(DEDUP_CACHE_SIZE)
+# contadores acumulados do container: registros recebidos e duplicados evitados
+dedup_stats = {'records': 0, 'batch': 0, 'cache': 0, 'conditional': 0}
+
+
+def build_item(data, ttl):
+    item = {
+        'numero_cartao': {'S': str(data['numero_cartao'])},
+        'transaction_id': {'S': str(data['transaction_id'])},
+        'horario_transacao': {'S': str(data['horario_transacao'])},
+        'Valor': {'N': str(data['valor'])},
+        'TTL': {'N': ttl}
+    }
+    # tipo: 'janela' (uma linha por cartao e janela) ou 'velocidade' (uma por transacao)
+    if data.get('tipo'):
+        item['Tipo'] = {'S': str(data['tipo'])}
+    # janelas por cartao do Flink trazem a quantidade e o maior valor da janela
+    if data.get('quantidade') is not None:
+        item['Quantidade'] = {'N': str(data['quantidade'])}
+    if data.get('maior_valor') is not None:
+        item['MaiorValor'] = {'N': str(data['maior_valor'])}
+    # resumo: o Flink indica se as transacoes da linha entram no resumo por cartao
+    if data.get('resumo') is not None:
+        item['Resumo'] = {'BOOL': bool(data['resumo'])}
+    return item
+
+
+def write_batch(items):
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    attempt = 0
+    while True:
+        response = ddb_client.batch_write_item(RequestItems={TABLE: requests})
+        requests = response.get('UnprocessedItems', {}).get(TABLE, [])
+        if not requests:
+            break
+        attempt += 1
+        if attempt > MAX_RETRIES:
+            raise RuntimeError(f'{len(requests)} itens nao processados apos {MAX_RETRIES} tentativas')
+        # backoff exponencial com jitter antes de reenviar apenas os nao processados
+        sleep(random.uniform(0, min(2, 0.05 * 2 ** attempt)))
+    return items, attempt
+
+
+def write_conditional(items):
+    # backstop para duplicados que escaparam do cache (outro container, cold start)
+    written = []
+    for item in items:
+        try:
+            ddb_client.put_item(
+                TableName=TABLE,
+                Item=item,
+                ConditionExpression='attribute_not_exists(transaction_id)'
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        written.append(item)
+    return written, len(items) - len(written)
+
+
+def is_window(item):
+    # linhas anteriores ao campo tipo: janela e a que traz Quantidade
+    if 'Tipo' in item:
+        return item['Tipo']['S'] == 'janela'
+    return 'Quantidade' in item
+
+
+def in_summary(item):
+    # o Flink marca com Resumo as linhas que podem ser somadas: velocidade e
+    # janelas tumbling com mode=window. Janelas deslizantes se sobrepoem e, com
+    # mode=both, as mesmas transacoes tambem chegam como linhas de velocidade.
+    # Linhas anteriores ao campo: apenas as de velocidade
+    if 'Resumo' in item:
+        return item['Resumo']['BOOL']
+    return not is_window(item)
+
+
+def summarize(items):
+    # consolida os itens gravados no lote por cartao. Uma janela soma a
+    # quantidade, o valor e o maior valor das transacoes dela, com o fim da
+    # janela como horario; toda janela conta em alertas_janela
+    summaries = {}
+    for item in items:
+        summary = summaries.setdefault(item['numero_cartao']['S'], {'quantidade': 0, 'alertas_janela': 0})
+        if is_window(item):
+            summary['alertas_janela'] += 1
+        if not in_summary(item):
+            continue
+        quantidade = int(item['Quantidade']['N']) if 'Quantidade' in item else 1
+        valor = Decimal(item['Valor']['N'])
+        maior = Decimal(item['MaiorValor']['N']) if 'MaiorValor' in item else valor
+        horario = item['horario_transacao']['S']
+        if not summary['quantidade']:
+            summary.update({
+                'total_valor': valor, 'maior_valor': maior,
+                'primeiro_horario': horario, 'ultimo_horario': horario
+            })
+        else:
+            summary['total_valor'] += valor
+            summary['maior_valor'] = max(summary['maior_valor'], maior)
+            summary['primeiro_horario'] = min(summary['primeiro_horario'], horario)
+            summary['ultimo_horario'] = max(summary['ultimo_horario'], horario)
+        summary['quantidade'] += quantidade
+    return summaries
+
+
+def _extremes(attributes):
+    return (
+        Decimal(attributes['maior_valor']['N']),
+        attributes['primeiro_horario']['S'],
+        attributes['ultimo_horario']['S']
+    )
+
+
+def update_summary(numero_cartao, summary):
+    key = {'numero_cartao': {'S': numero_cartao}}
+    if not summary['quantidade']:
+        ddb_client.update_item(
+            TableName=SUMMARY_TABLE,
+            Key=key,
+            UpdateExpression='ADD alertas_janela :alertas',
+            ExpressionAttributeValues={':alertas': {'N': str(summary['alertas_janela'])}}
+        )
+        return
+    # contagem e soma sao somadas atomicamente em um unico UpdateItem por cartao
+    response = ddb_client.update_item(
+        TableName=SUMMARY_TABLE,
+        Key=key,
+        UpdateExpression=(
+            'ADD quantidade :quantidade, total_valor :total, alertas_janela :alertas '
+            'SET maior_valor = if_not_exists(maior_valor, :maior), '
+            'primeiro_horario = if_not_exists(primeiro_horario, :primeiro), '
+            'ultimo_horario = if_not_exists(ultimo_horario, :ultimo)'
+        ),
+        ExpressionAttributeValues={
+            ':quantidade': {'N': str(summary['quantidade'])},
+            ':total': {'N': str(summary['total_valor'])},
+            ':alertas': {'N': str(summary['alertas_janela'])},
+            ':maior': {'N': str(summary['maior_valor'])},
+            ':primeiro': {'S': summary['primeiro_horario']},
+            ':ultimo': {'S': summary['ultimo_horario']}
+        },
+        ReturnValues='ALL_NEW'
+    )
+    current = _extremes(response['Attributes'])
+    # o DynamoDB nao tem max/min atomico: os extremos sao atualizados com
+    # compare-and-set, apenas quando o lote os ultrapassa
+    while True:
+        maior, primeiro, ultimo = current
+        wanted = (
+            max(maior, summary['maior_valor']),
+            min(primeiro, summary['primeiro_horario']),
+            max(ultimo, summary['ultimo_horario'])
+        )
+        if wanted == current:
+            return
+        try:
+            ddb_client.update_item(
+                TableName=SUMMARY_TABLE,
+                Key=key,
+                UpdateExpression='SET maior_valor = :maior, primeiro_horario = :primeiro, ultimo_horario = :ultimo',
+                ConditionExpression=(
+                    'maior_valor = :maior_atual AND primeiro_horario = :primeiro_atual '
+                    'AND ultimo_horario = :ultimo_atual'
+                ),
+                ExpressionAttributeValues={
+                    ':maior': {'N': str(wanted[0])},
+                    ':primeiro': {'S': wanted[1]},
+                    ':ultimo': {'S': wanted[2]},
+                    ':maior_atual': {'N': str(maior)},
+                    ':primeiro_atual': {'S': primeiro},
+                    ':ultimo_atual': {'S': ultimo}
+                }
+            )
+            return
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        response = ddb_client.get_item(TableName=SUMMARY_TABLE, Key=key, ConsistentRead=True)
+        current = _extremes(response['Item'])
+
+
+def hit_rate(stats):
+    skipped = stats['batch'] + stats['cache'] + stats['conditional']
+    return 100 * skipped / stats['records'] if stats['records'] else 0
 
 
 def handler(event, context):
     ttl = str(time() + 24*3600*30)
+    items = {}
+    sequences = {}
+    failures = []
+    stats = {'records': 0, 'batch': 0, 'cache': 0, 'conditional': 0}
     for record in event['Records']:
-        payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-        data = json.loads(payload)
-        ddb_client.put_item(
-            TableName=TABLE,
-            Item={
-                'numero_cartao': {'S': str(data['numero_cartao'])},
-                'transaction_id': {'S': str(data['transaction_id'])},
-                'horario_transacao': {'S': str(data['horario_transacao'])},
-                'Valor':{'N': str(data['valor'])},
-                'TTL': {'N': ttl}
-            }
-        )
\ No newline at end of file
+        sequence = record['kinesis']['sequenceNumber']
+        try:
+            # o sink do Flink agrega varios registros por registro Kinesis (formato KPL)
+            parsed = []
+            for _, payload in deaggregate(base64.b64decode(record['kinesis']['data'])):
+                data = decode(payload)
+                parsed.append(((str(data['numero_cartao']), str(data['transaction_id'])), build_item(data, ttl)))
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            # registro invalido: reportado para ser isolado pelo bisect e enviado a DLQ
+            print(f"Registro invalido {sequence}: {type(error).__name__}: {error}")
+            failures.append(sequence)
+            continue
+        for key, item in parsed:
+            stats['records'] += 1
+            if key in items:
+                stats['batch'] += 1
+            elif key in seen:
+                stats['cache'] += 1
+                continue
+            # BatchWriteItem rejeita chaves repetidas na mesma requisicao
+            items[key] = item
+            sequences.setdefault(key, set()).add(sequence)
+
+    keys = list(items)
+    if CONDITIONAL_WRITE:
+        # um PutItem por item, todos em paralelo no executor
+        batches = [[key] for key in keys]
+        write = write_conditional
+    else:
+        batches = [keys[i:i + BATCH_SIZE] for i in range(0, len(keys), BATCH_SIZE)]
+        write = write_batch
+    start = perf_counter()
+    futures = [(batch, executor.submit(write, [items[key] for key in batch])) for batch in batches]
+    written = []
+    extras = 0
+    for batch, future in futures:
+        try:
+            items_written, extra = future.result()
+        except Exception as error:
+            print(f"Gravacao: falha em lote de {len(batch)} itens: {error!r}")
+            failures.extend(sequence for key in batch for sequence in sequences[key])
+            continue
+        written.extend(items_written)
+        extras += extra
+        # itens que ja existiam na tabela nao entram no resumo
+        written_keys = {(item['numero_cartao']['S'], item['transaction_id']['S']) for item in items_written}
+        for key in batch:
+            if key not in written_keys or not SUMMARY_TABLE:
+                seen.add(key)
+    duration = (perf_counter() - start) * 1000
+    if CONDITIONAL_WRITE:
+        stats['conditional'] += extras
+        print(f"PutItem condicional: {len(written)} itens, {extras} ja existentes, {len(batches)} chamadas em {duration:.1f} ms")
+    else:
+        print(f"BatchWriteItem: {len(written)} itens em {len(batches)} lotes em {duration:.1f} ms ({extras} reenvios)")
+    print(f"Gravados {len(written)} itens de {len(event['Records'])} registros")
+
+    start = perf_counter()
+    # sem tabela de resumo os itens ja foram marcados como vistos apos a gravacao
+    summaries = summarize(written) if SUMMARY_TABLE else {}
+    futures = [(card, executor.submit(update_summary, card, summary)) for card, summary in summaries.items()]
+    keys_by_card = {}
+    for item in written:
+        keys_by_card.setdefault(item['numero_cartao']['S'], []).append(
+            (item['numero_cartao']['S'], item['transaction_id']['S'])
+        )
+    updated = 0
+    for card, future in futures:
+        try:
+            future.result()
+        except Exception as error:
+            print(f"Resumo: falha ao atualizar o cartao {card}: {error!r}")
+            failures.extend(sequence for key in keys_by_card[card] for sequence in sequences[key])
+            continue
+        updated += 1
+        # so marca como visto depois de gravado e resumido, para que falhas sejam reprocessadas
+        for key in keys_by_card[card]:
+            seen.add(key)
+    if SUMMARY_TABLE:
+        print(
+            f"Resumo: {updated} cartoes atualizados, {len(summaries) - updated} com falha "
+            f"em {(perf_counter() - start) * 1000:.1f} ms"
+        )
+
+    for name in stats:
+        dedup_stats[name] += stats[name]
+    print(
+        f"Dedup: {stats['batch']} no lote, {stats['cache']} no cache, {stats['conditional']} condicionais "
+        f"de {stats['records']} ({hit_rate(stats):.1f}%); container {hit_rate(dedup_stats):.1f}% "
+        f"de {dedup_stats['records']}, cache com {len(seen.keys)} chaves"
+    )
+
+    # o Lambda retoma o shard a partir do menor sequence number reportado
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': sequence} for sequence in sorted(set(failures), key=int)
+        ]
+    }
@@ -0,0 +1,170 @@
+import hashlib
+
+from wire import read_varint, write_varint
+
+# Agregacao e desagregacao de registros no formato do KPL, usado pelo gerador
+# (KPL_AGGREGATION) e pelo sink Kinesis do Flink com
+# 'sink.producer.aggregation-enabled' = 'true':
+#
+#   magic (4 bytes) | AggregatedRecord (protobuf) | md5 do protobuf (16 bytes)
+#
+#   AggregatedRecord: 1 partition_key_table, 2 explicit_hash_key_table, 3 records
+#   Record:           1 partition_key_index, 2 explicit_hash_key_index, 3 data
+#
+# https://github.com/awslabs/amazon-kinesis-producer/blob/master/aggregation-format.md
+
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+KPL_DIGEST_SIZE = 16
+MAX_BYTES_PER_RECORD = 1024 * 1024
+
+
+def _varint_size(value):
+    out = bytearray()
+    write_varint(out, value)
+    return len(out)
+
+
+def _field(out, number, payload):
+    # campo protobuf length-delimited (wire type 2)
+    write_varint(out, number << 3 | 2)
+    write_varint(out, len(payload))
+    out += payload
+
+
+def _fields(buf):
+    # percorre uma mensagem protobuf devolvendo (numero do campo, valor)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = read_varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Wire type protobuf nao suportado: {wire_type}")
+        if pos > end:
+            raise ValueError('Mensagem protobuf truncada')
+        yield number, value
+
+
+class RecordAggregator:
+    '''Empacota varios registros em um unico registro Kinesis no formato KPL.'''
+
+    def __init__(self, max_bytes=MAX_BYTES_PER_RECORD):
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        self.partition_keys = {}
+        self.explicit_hash_keys = {}
+        self.records = []
+        self.size = len(KPL_MAGIC) + KPL_DIGEST_SIZE
+
+    def __len__(self):
+        return len(self.records)
+
+    def _record_size(self, data, partition_key, explicit_hash_key):
+        size = 0
+        pk_index = self.partition_keys.get(partition_key)
+        if pk_index is None:
+            pk = partition_key.encode('utf-8')
+            pk_index = len(self.partition_keys)
+            size += 1 + _varint_size(len(pk)) + len(pk)
+        inner = 1 + _varint_size(pk_index) + 1 + _varint_size(len(data)) + len(data)
+        if explicit_hash_key is not None:
+            ehk_index = self.explicit_hash_keys.get(explicit_hash_key)
+            if ehk_index is None:
+                ehk = explicit_hash_key.encode('utf-8')
+                ehk_index = len(self.explicit_hash_keys)
+                size += 1 + _varint_size(len(ehk)) + len(ehk)
+            inner += 1 + _varint_size(ehk_index)
+        return size + 1 + _varint_size(inner) + inner
+
+    def fits(self, data, partition_key, explicit_hash_key=None):
+        size = self._record_size(data, partition_key, explicit_hash_key)
+        # a chave de particao do registro agregado tambem conta no limite de 1 MB
+        outer_key = next(iter(self.partition_keys), partition_key)
+        return self.size + size + len(outer_key.encode('utf-8')) <= self.max_bytes
+
+    def add(self, data, partition_key, explicit_hash_key=None):
+        self.size += self._record_size(data, partition_key, explicit_hash_key)
+        pk_index = self.partition_keys.setdefault(partition_key, len(self.partition_keys))
+        ehk_index = None
+        if explicit_hash_key is not None:
+            ehk_index = self.explicit_hash_keys.setdefault(explicit_hash_key, len(self.explicit_hash_keys))
+        self.records.append((pk_index, ehk_index, data))
+
+    def serialize(self):
+        body = bytearray()
+        for key in self.partition_keys:
+            _field(body, 1, key.encode('utf-8'))
+        for key in self.explicit_hash_keys:
+            _field(body, 2, key.encode('utf-8'))
+        for pk_index, ehk_index, data in self.records:
+            record = bytearray()
+            write_varint(record, 1 << 3)
+            write_varint(record, pk_index)
+            if ehk_index is not None:
+                write_varint(record, 2 << 3)
+                write_varint(record, ehk_index)
+            _field(record, 3, data)
+            _field(body, 3, record)
+        body = bytes(body)
+        return KPL_MAGIC + body + hashlib.md5(body).digest()
+
+    def to_entry(self):
+        entry = {
+            'Data': self.serialize(),
+            'PartitionKey': next(iter(self.partition_keys)),
+        }
+        if self.explicit_hash_keys:
+            entry['ExplicitHashKey'] = next(iter(self.explicit_hash_keys))
+        self.clear()
+        return entry
+
+
+def is_aggregated(payload):
+    return len(payload) > len(KPL_MAGIC) + KPL_DIGEST_SIZE and payload[:len(KPL_MAGIC)] == KPL_MAGIC
+
+
+def deaggregate(payload, partition_key=None):
+    '''Devolve a lista de (partition_key, data) contida em um registro Kinesis.
+
+    Registros sem o magic do KPL, ou cujo md5 nao confere, sao devolvidos
+    inteiros, como faz a biblioteca de desagregacao do KPL.
+    '''
+    if not is_aggregated(payload):
+        return [(partition_key, payload)]
+    message = payload[len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+    if hashlib.md5(message).digest() != payload[-KPL_DIGEST_SIZE:]:
+        return [(partition_key, payload)]
+
+    message = memoryview(message)
+    partition_keys = []
+    records = []
+    for number, value in _fields(message):
+        if number == 1:
+            partition_keys.append(bytes(value).decode('utf-8'))
+        elif number == 3:
+            pk_index = None
+            data = b''
+            for field, inner in _fields(value):
+                if field == 1:
+                    pk_index = inner
+                elif field == 3:
+                    data = bytes(inner)
+            records.append((pk_index, data))
+    return [
+        (partition_keys[pk_index] if pk_index is not None else partition_key, data)
+        for pk_index, data in records
+    ]
@@ -0,0 +1,205 @@
+import json
+import struct
+import uuid
+from datetime import datetime, timedelta
+
+# Formato binario compacto e versionado para os registros do card-stream e do
+# realtime-stream. Os campos sao gravados por posicao, sem nomes:
+#
+#   0x00 | id do schema (uint8) | campos
+#
+# Um JSON nunca comeca com 0x00, entao registros JSON e binarios podem
+# conviver no mesmo stream durante a migracao. Uma mudanca de schema ganha um
+# novo id; ids existentes nunca sao alterados. O id 2 (um rascunho de alerta
+# que nunca foi emitido) fica reservado.
+
+MARKER = 0x00
+EPOCH = datetime(1970, 1, 1)
+F64 = struct.Struct('<d')
+
+TIPO_CARTAO = ['unlimited', 'black', 'platinum', 'gold', 'standard']
+COR_CARTAO = ['preto', 'prata', 'amarelo', 'azul', 'verde']
+TIPO_TRANSACAO = ['credito', 'debito']
+ENUM_OUTRO = 0xff
+
+SCHEMAS = {
+    1: ('transacao', [
+        ('nome', 'str'),
+        ('cpf', 'str'),
+        ('valor', 'decimal2'),
+        ('bandeira', 'str'),
+        ('numero_cartao', 'str'),
+        ('cvv', 'str'),
+        ('exp', 'str'),
+        ('tipo_cartao', ('enum', TIPO_CARTAO)),
+        ('cor_cartao', ('enum', COR_CARTAO)),
+        ('tipo_transacao', ('enum', TIPO_TRANSACAO)),
+        ('localizacao', ('record', [
+            ('lat', 'str'),
+            ('lng', 'str'),
+            ('cidade', 'str'),
+            ('estado', 'str'),
+        ])),
+        ('horario_transacao', 'timestamp'),
+        ('transaction_id', 'uuid'),
+    ]),
+}
+SCHEMA_IDS = {nome: schema_id for schema_id, (nome, _) in SCHEMAS.items()}
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def _write_str(out, value):
+    data = str(value).encode('utf-8')
+    write_varint(out, len(data))
+    out += data
+
+
+def _read_str(buf, pos):
+    size = buf[pos]
+    if size < 0x80:
+        pos += 1
+    else:
+        size, pos = read_varint(buf, pos)
+    return buf[pos:pos + size].decode('utf-8'), pos + size
+
+
+def _encoder(tipo):
+    if tipo == 'str':
+        return _write_str
+    if tipo == 'f64':
+        return lambda out, value: out.extend(F64.pack(value))
+    if tipo == 'decimal2':
+        return lambda out, value: write_varint(out, _zigzag(round(value * 100)))
+    if tipo == 'timestamp':
+        def write(out, value):
+            horario = datetime.fromisoformat(str(value).replace('Z', ''))
+            write_varint(out, _zigzag((horario - EPOCH) // timedelta(microseconds=1)))
+        return write
+    if tipo == 'uuid':
+        return lambda out, value: out.extend(uuid.UUID(value).bytes)
+    kind, arg = tipo
+    if kind == 'enum':
+        indices = {valor: i for i, valor in enumerate(arg)}
+
+        def write(out, value):
+            i = indices.get(value)
+            if i is None:
+                out.append(ENUM_OUTRO)
+                _write_str(out, value)
+            else:
+                out.append(i)
+        return write
+    if kind == 'record':
+        campos = [(nome, _encoder(sub)) for nome, sub in arg]
+
+        def write(out, value):
+            for nome, encode in campos:
+                encode(out, value[nome])
+        return write
+    raise ValueError(f"Tipo desconhecido: {tipo}")
+
+
+def _decoder(tipo):
+    if tipo == 'str':
+        return _read_str
+    if tipo == 'f64':
+        return lambda buf, pos: (F64.unpack_from(buf, pos)[0], pos + F64.size)
+    if tipo == 'decimal2':
+        def read(buf, pos):
+            value, pos = read_varint(buf, pos)
+            return _unzigzag(value) / 100, pos
+        return read
+    if tipo == 'timestamp':
+        def read(buf, pos):
+            value, pos = read_varint(buf, pos)
+            return (EPOCH + timedelta(microseconds=_unzigzag(value))).isoformat(), pos
+        return read
+    if tipo == 'uuid':
+        def read(buf, pos):
+            h = buf[pos:pos + 16].hex()
+            return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}', pos + 16
+        return read
+    kind, arg = tipo
+    if kind == 'enum':
+        def read(buf, pos):
+            i = buf[pos]
+            if i == ENUM_OUTRO:
+                return _read_str(buf, pos + 1)
+            return arg[i], pos + 1
+        return read
+    if kind == 'record':
+        campos = [(nome, _decoder(sub)) for nome, sub in arg]
+
+        def read(buf, pos):
+            value = {}
+            for nome, decode in campos:
+                value[nome], pos = decode(buf, pos)
+            return value, pos
+        return read
+    raise ValueError(f"Tipo desconhecido: {tipo}")
+
+
+ENCODERS = {schema_id: _encoder(('record', campos)) for schema_id, (_, campos) in SCHEMAS.items()}
+DECODERS = {schema_id: _decoder(('record', campos)) for schema_id, (_, campos) in SCHEMAS.items()}
+
+
+def encode(record, schema='transacao'):
+    schema_id = SCHEMA_IDS[schema]
+    out = bytearray((MARKER, schema_id))
+    ENCODERS[schema_id](out, record)
+    return bytes(out)
+
+
+def is_binary(payload):
+    return len(payload) > 1 and payload[0] == MARKER
+
+
+def decode(payload):
+    '''Decodifica um registro binario ou JSON, conforme o marcador do primeiro byte.
+
+    Registros binarios truncados ou corrompidos levantam ValueError.
+    '''
+    if not is_binary(payload):
+        return json.loads(payload)
+    decoder = DECODERS.get(payload[1])
+    if decoder is None:
+        raise ValueError(f"Schema binario desconhecido: {payload[1]}")
+    try:
+        record, pos = decoder(payload, 2)
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise ValueError(f"Registro binario invalido: {error}") from error
+    # campos lidos por fatia (str, uuid) nao falham quando o registro e cortado
+    if pos != len(payload):
+        raise ValueError(f"Registro binario com {len(payload)} bytes, esperado {pos}")
+    return record
+
+
+def serialize(record, formato='json', schema='transacao'):
+    if formato == 'binary':
+        return encode(record, schema)
+    return json.dumps(record).encode('utf-8')
@@ -4,4 +4,4 @@ set -e
 
 # call tests for your code below
 
-# pytest tests/unit/my_test.py
\ No newline at end of file
+pytest tests/unit
\ No newline at end of file
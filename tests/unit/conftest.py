@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modulos da layer compartilhada (lambda_app/shared/python), como no Lambda e no gerador
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_app', 'shared', 'python'))
@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+from decimal import Decimal
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from kpl import KPL_MAGIC, RecordAggregator
+from wire import encode
+
+from test_wire import TRANSACAO
+
+FUNCTION = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_app', 'consumer', 'function.py')
+
+
+class FakeDynamo:
+
+    def __init__(self):
+        self.items = []
+        self.updates = []
+
+    def batch_write_item(self, RequestItems):
+        for requests in RequestItems.values():
+            self.items.extend(request['PutRequest']['Item'] for request in requests)
+        return {}
+
+    def put_item(self, TableName, Item, ConditionExpression=None):
+        if any(item['transaction_id'] == Item['transaction_id'] for item in self.items):
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items.append(Item)
+
+    def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+        values = kwargs['ExpressionAttributeValues']
+        return {'Attributes': {
+            'maior_valor': values.get(':maior', {'N': '0'}),
+            'primeiro_horario': values.get(':primeiro', {'S': ''}),
+            'ultimo_horario': values.get(':ultimo', {'S': ''}),
+        }}
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('TABLE', 'transacoes')
+    monkeypatch.delenv('SUMMARY_TABLE', raising=False)
+    spec = importlib.util.spec_from_file_location('consumer_function', FUNCTION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.ddb_client = FakeDynamo()
+    return module
+
+
+def kinesis_event(*payloads):
+    return {'Records': [
+        {'kinesis': {'sequenceNumber': str(i), 'data': base64.b64encode(payload).decode('ascii')}}
+        for i, payload in enumerate(payloads, start=1)
+    ]}
+
+
+def test_registros_invalidos_nao_derrubam_o_lote(consumer):
+    aggregator = RecordAggregator()
+    aggregator.add(json.dumps(TRANSACAO).encode('utf-8'), TRANSACAO['numero_cartao'])
+    # campo 3 declara 16 bytes e traz 1; o md5 confere, entao o registro e desagregado
+    body = bytes([0x1a, 0x10, 0x01])
+    corrupt_kpl = KPL_MAGIC + body + hashlib.md5(body).digest()
+
+    response = consumer.handler(kinesis_event(
+        aggregator.to_entry()['Data'],
+        encode(TRANSACAO)[:5],
+        encode(TRANSACAO)[:-4],
+        corrupt_kpl,
+    ), None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': '2'}, {'itemIdentifier': '3'}, {'itemIdentifier': '4'}]}
+    assert [item['transaction_id']['S'] for item in consumer.ddb_client.items] == [TRANSACAO['transaction_id']]
+
+
+def test_registro_binario_gravado(consumer):
+    response = consumer.handler(kinesis_event(encode(TRANSACAO)), None)
+
+    assert response == {'batchItemFailures': []}
+    assert consumer.ddb_client.items[0]['Valor'] == {'N': str(TRANSACAO['valor'])}
+    # sem SUMMARY_TABLE o resumo e ignorado e o item ja conta como visto
+    assert consumer.ddb_client.updates == []
+    assert (TRANSACAO['numero_cartao'], TRANSACAO['transaction_id']) in consumer.seen
+
+
+def test_escrita_condicional_em_paralelo(consumer, monkeypatch):
+    monkeypatch.setattr(consumer, 'CONDITIONAL_WRITE', True)
+    transacoes = [dict(TRANSACAO, transaction_id=f'0f8fad5b-d9cb-469f-a165-7086772895{i:02d}') for i in range(30)]
+    consumer.handler(kinesis_event(*(encode(transacao) for transacao in transacoes[:20])), None)
+    consumer.seen.keys.clear()
+
+    response = consumer.handler(kinesis_event(*(encode(transacao) for transacao in transacoes)), None)
+
+    assert response == {'batchItemFailures': []}
+    assert len(consumer.ddb_client.items) == 30
+    assert consumer.dedup_stats['conditional'] == 20
+
+
+def test_resumo_soma_janelas_marcadas(consumer):
+    janela = {
+        'numero_cartao': '4111', 'transaction_id': '4111@2022-03-04 05:06:10', 'valor': 9000.5,
+        'horario_transacao': '2022-03-04 05:06:10', 'quantidade': 3, 'maior_valor': 6000.0,
+        'score': None, 'tipo': 'janela',
+    }
+    items = [
+        consumer.build_item(dict(janela, resumo=True), '0'),
+        consumer.build_item(dict(janela, transaction_id='4111@2022-03-04 05:06:15', resumo=False), '0'),
+        consumer.build_item(dict(janela, transaction_id='4111@2022-03-04 05:06:20'), '0'),
+    ]
+
+    summary = consumer.summarize(items)['4111']
+
+    assert summary['alertas_janela'] == 3
+    assert summary['quantidade'] == 3
+    assert summary['total_valor'] == Decimal('9000.5')
+    assert summary['maior_valor'] == Decimal('6000.0')
+    assert summary['ultimo_horario'] == '2022-03-04 05:06:10'
@@ -0,0 +1,59 @@
+from kpl import KPL_MAGIC, RecordAggregator, deaggregate, is_aggregated
+
+
+def test_roundtrip_mixed_partition_keys():
+    aggregator = RecordAggregator()
+    records = [(f'registro-{i}'.encode('utf-8'), f'cartao-{i % 3}') for i in range(10)]
+    for data, partition_key in records:
+        aggregator.add(data, partition_key)
+    entry = aggregator.to_entry()
+
+    assert entry['PartitionKey'] == 'cartao-0'
+    assert 'ExplicitHashKey' not in entry
+    assert is_aggregated(entry['Data'])
+    assert deaggregate(entry['Data']) == [(pk, data) for data, pk in records]
+    assert len(aggregator) == 0
+
+
+def test_roundtrip_explicit_hash_key():
+    aggregator = RecordAggregator()
+    aggregator.add(b'a', 'cartao-1', '100')
+    aggregator.add(b'b', 'cartao-2', '200')
+    aggregator.add(b'c', 'cartao-1')
+    entry = aggregator.to_entry()
+
+    assert entry['ExplicitHashKey'] == '100'
+    assert deaggregate(entry['Data']) == [('cartao-1', b'a'), ('cartao-2', b'b'), ('cartao-1', b'c')]
+
+
+def test_size_tracks_serialized_record():
+    aggregator = RecordAggregator()
+    for i in range(200):
+        aggregator.add(b'x' * (i * 7), f'cartao-{i % 13}', str(i % 5) if i % 2 else None)
+    assert aggregator.size == len(aggregator.serialize())
+
+
+def test_fits_respects_limit():
+    aggregator = RecordAggregator(max_bytes=200)
+    added = 0
+    while aggregator.fits(b'x' * 30, 'cartao'):
+        aggregator.add(b'x' * 30, 'cartao')
+        added += 1
+    entry = aggregator.to_entry()
+    assert added > 0
+    assert len(entry['Data']) + len(entry['PartitionKey']) <= 200
+    assert len(deaggregate(entry['Data'])) == added
+
+
+def test_plain_record_passes_through():
+    assert deaggregate(b'{"valor": 1}', 'pk') == [('pk', b'{"valor": 1}')]
+
+
+def test_corrupted_digest_passes_through():
+    aggregator = RecordAggregator()
+    aggregator.add(b'dados', 'cartao')
+    payload = aggregator.serialize()
+    corrompido = payload[:-1] + bytes([payload[-1] ^ 0xff])
+
+    assert corrompido.startswith(KPL_MAGIC)
+    assert deaggregate(corrompido, 'pk') == [('pk', corrompido)]
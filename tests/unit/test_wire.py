@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from wire import decode, encode, is_binary, serialize
+
+TRANSACAO = {
+    'nome': 'Maria Silva',
+    'cpf': '123.456.789-09',
+    'valor': 1234.56,
+    'bandeira': 'VISA 16 digit',
+    'numero_cartao': '4111111111111111',
+    'cvv': '123',
+    'exp': '12/30',
+    'tipo_cartao': 'gold',
+    'cor_cartao': 'azul',
+    'tipo_transacao': 'credito',
+    'localizacao': {'lat': '-23.5', 'lng': '-46.6', 'cidade': 'São Paulo', 'estado': 'São Paulo'},
+    'horario_transacao': '2022-03-04T05:06:07.891011',
+    'transaction_id': '0f8fad5b-d9cb-469f-a165-70867728950e',
+}
+
+
+def test_transacao_roundtrip():
+    payload = encode(TRANSACAO)
+    assert is_binary(payload)
+    assert decode(payload) == TRANSACAO
+
+
+def test_enum_fora_da_lista():
+    transacao = dict(TRANSACAO, tipo_cartao='titanium')
+    assert decode(encode(transacao)) == transacao
+
+
+def test_schema_desconhecido():
+    payload = bytearray(encode(TRANSACAO))
+    payload[1] = 2
+    with pytest.raises(ValueError):
+        decode(bytes(payload))
+
+
+def test_json_continua_aceito():
+    payload = serialize(TRANSACAO)
+    assert not is_binary(payload)
+    assert decode(payload) == json.loads(payload)
+
+
+def test_registro_truncado():
+    payload = encode(TRANSACAO)
+    for size in (5, len(payload) - 4):
+        with pytest.raises(ValueError):
+            decode(payload[:size])